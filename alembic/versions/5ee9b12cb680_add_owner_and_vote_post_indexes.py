@@ -0,0 +1,37 @@
+"""add owner and vote post indexes
+
+Revision ID: 5ee9b12cb680
+Revises: de0be995d740
+Create Date: 2026-10-18 10:22:43.846953
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5ee9b12cb680'
+down_revision: Union[str, None] = 'de0be995d740'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Built concurrently, outside the migration transaction, so votes and posts stay writable meanwhile.
+    # votes(post_id): the primary key leads with user_id, so deleting a post (ON DELETE CASCADE)
+    # and recounting votes per post scanned the whole table.
+    # posts(owner_id): deleting a user cascades through it, and exports filter on it.
+    # posts(created_at, id) already exists as ix_posts_created_at_id (revision ee6c9af9b08b).
+    with op.get_context().autocommit_block():
+        op.create_index('ix_votes_post_id', 'votes', ['post_id'], postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_posts_owner_id', 'posts', ['owner_id'], postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_posts_owner_id', table_name='posts', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_votes_post_id', table_name='votes', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,58 @@
+"""add vote_count column to posts table
+
+Revision ID: 772ae2df86d9
+Revises: ee6c9af9b08b
+Create Date: 2026-10-18 09:49:22.307243
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '772ae2df86d9'
+down_revision: Union[str, None] = 'ee6c9af9b08b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+VOTE_COUNT_FUNCTION = """
+CREATE OR REPLACE FUNCTION posts_vote_count_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE posts SET vote_count = vote_count + 1 WHERE id = NEW.post_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE posts SET vote_count = vote_count - 1 WHERE id = OLD.post_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('posts', sa.Column('vote_count', sa.Integer(), nullable=False, server_default='0'))
+
+    # Backfill the counter from the existing votes
+    op.execute("""
+        UPDATE posts SET vote_count = counts.total
+        FROM (SELECT post_id, count(*) AS total FROM votes GROUP BY post_id) AS counts
+        WHERE posts.id = counts.post_id
+    """)
+
+    # Keep it in sync in the same transaction as every insert/delete on votes (including cascades)
+    op.execute(VOTE_COUNT_FUNCTION)
+    op.execute("""
+        CREATE TRIGGER votes_vote_count AFTER INSERT OR DELETE ON votes
+        FOR EACH ROW EXECUTE FUNCTION posts_vote_count_trg()
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS votes_vote_count ON votes")
+    op.execute("DROP FUNCTION IF EXISTS posts_vote_count_trg()")
+    op.drop_column('posts', 'vote_count')
@@ -0,0 +1,37 @@
+"""add top and owner feed indexes to posts
+
+Revision ID: c72e7a4cfe1b
+Revises: 5ee9b12cb680
+Create Date: 2026-10-18 10:24:34.445208
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c72e7a4cfe1b'
+down_revision: Union[str, None] = '5ee9b12cb680'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # GET /posts?order_by=top reads the first rows of (vote_count, id) backwards instead of sorting every post.
+    # GET /users/{id}/posts and ?owner_id= do the same on (owner_id, created_at, id), which also covers
+    # the cascades ix_posts_owner_id was serving, so that one goes.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_posts_vote_count_id', 'posts', ['vote_count', 'id'], postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_posts_owner_id_created_at_id', 'posts', ['owner_id', 'created_at', 'id'], postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_posts_owner_id', table_name='posts', postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index('ix_posts_owner_id', 'posts', ['owner_id'], postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_posts_owner_id_created_at_id', table_name='posts', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_posts_vote_count_id', table_name='posts', postgresql_concurrently=True, if_exists=True)
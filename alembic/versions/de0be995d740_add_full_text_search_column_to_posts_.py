@@ -0,0 +1,35 @@
+"""add full text search column to posts table
+
+Revision ID: de0be995d740
+Revises: 772ae2df86d9
+Create Date: 2026-10-18 09:57:54.367005
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'de0be995d740'
+down_revision: Union[str, None] = '772ae2df86d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('posts', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed("to_tsvector('english', title || ' ' || content)", persisted=True),
+    ))
+    op.create_index('ix_posts_search_vector', 'posts', ['search_vector'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_posts_search_vector', table_name='posts', postgresql_using='gin')
+    op.drop_column('posts', 'search_vector')
@@ -0,0 +1,29 @@
+"""add created_at id index to posts table
+
+Revision ID: ee6c9af9b08b
+Revises: b5865ff7136a
+Create Date: 2026-10-18 09:48:21.679652
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ee6c9af9b08b'
+down_revision: Union[str, None] = 'b5865ff7136a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Backs keyset (cursor) pagination of GET /posts ordered by (created_at, id)
+    op.create_index('ix_posts_created_at_id', 'posts', ['created_at', 'id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_posts_created_at_id', table_name='posts')
@@ -0,0 +1,183 @@
+"""
+Small caches shared by the auth and read paths.
+
+Every cache is per process by default. Setting CACHE_REDIS_URL moves them
+to a shared Redis, in which case cached values must be JSON serializable.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+
+from app import metrics
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Every cache built by make_cache, by name, for /metrics
+caches = {}
+
+
+class MemoryCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] <= time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, ttl: float | None = None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    """
+    Same interface as MemoryCache, backed by a Redis shared between workers.
+    Redis errors are logged and treated as misses so an outage only costs a DB round-trip.
+    """
+
+    def __init__(self, client, prefix: str, ttl: float, errors=(Exception,)):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.errors = errors
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            raw = self.client.get(f"{self.prefix}{key}")
+        except self.errors:
+            logger.warning("Cache get failed for %s%s", self.prefix, key, exc_info=True)
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            self.client.set(f"{self.prefix}{key}", json.dumps(value), px=max(int(ttl * 1000), 1))
+        except self.errors:
+            logger.warning("Cache set failed for %s%s", self.prefix, key, exc_info=True)
+
+    def delete(self, key):
+        try:
+            self.client.delete(f"{self.prefix}{key}")
+        except self.errors:
+            logger.warning("Cache delete failed for %s%s", self.prefix, key, exc_info=True)
+
+    def clear(self):
+        try:
+            for key in self.client.scan_iter(match=f"{self.prefix}*"):
+                self.client.delete(key)
+        except self.errors:
+            logger.warning("Cache clear failed for %s*", self.prefix, exc_info=True)
+
+
+@lru_cache
+def redis_client():
+    import redis  # optional dependency, only needed when CACHE_REDIS_URL is set
+
+    return redis.Redis.from_url(settings.cache_redis_url), redis.RedisError
+
+
+def make_cache(name: str, maxsize: int, ttl: float):
+    if settings.cache_redis_url:
+        client, errors = redis_client()
+        cache = RedisCache(client, prefix=f"apidev:{name}:", ttl=ttl, errors=errors)
+    else:
+        cache = MemoryCache(maxsize, ttl)
+
+    caches[name] = cache
+    return cache
+
+
+# Serialized GET /posts and GET /posts/{id} responses.
+# Any post can show up on any list page, so list entries are keyed under a generation
+# token that every write replaces, while single posts are dropped one by one.
+post_cache = make_cache("posts", maxsize=settings.response_cache_size, ttl=settings.response_cache_ttl)
+
+
+def response_cache_enabled() -> bool:
+    # Per process, the other workers would keep serving what a write changed until the TTL ran out
+    if settings.response_cache_enabled is None:
+        return settings.cache_redis_url is not None
+    return settings.response_cache_enabled
+
+
+def post_list_generation() -> str:
+    generation = post_cache.get("lists")
+    if generation is None:
+        generation = uuid.uuid4().hex
+        post_cache.set("lists", generation)
+    return generation
+
+
+def invalidate_posts(*post_ids):
+    """Called by every write that changes what GET /posts or GET /posts/{id} return"""
+    for post_id in post_ids:
+        post_cache.delete(f"post:{post_id}")
+    post_cache.set("lists", uuid.uuid4().hex)
+    if settings.read_your_writes_seconds:
+        post_cache.set("written", True, ttl=settings.read_your_writes_seconds)
+
+
+def replicas_may_lag() -> bool:
+    """
+    Whether a post was written within READ_YOUR_WRITES_SECONDS, which the replicas may not have
+    applied yet. Responses read from a replica meanwhile are not cached: the writer, kept on the
+    primary, would still be served them
+    """
+    return bool(settings.read_your_writes_seconds) and post_cache.get("written") is not None
+
+
+def collect_caches():
+    lines = []
+    for metric, help, attribute in [
+        ("cache_hits_total", "Cache lookups that found an entry", "hits"),
+        ("cache_misses_total", "Cache lookups that found nothing", "misses"),
+    ]:
+        lines += [f"# HELP {metric} {help}", f"# TYPE {metric} counter"]
+        for name, cache in caches.items():
+            lines.append(f"{metric}{{{metrics.format_labels(cache=name)}}} {getattr(cache, attribute)}")
+    return lines
+
+
+metrics.collectors.append(collect_caches)
@@ -1,26 +1,220 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import hashlib
+import itertools
+import logging
+import time
+
+# Not from fastapi: this module is imported by Alembic and the maintenance commands, which never serve requests
+from starlette.requests import Request
+from sqlalchemy import create_engine, event, exc, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from app import metrics
+from app.cache import make_cache
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
 # Database URL format: 'postgresql://<username>:<password>@<host>/<database_name>'
 SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
 
+def pool_options(queue_pool_class):
+    """Engine keyword arguments for the connection pool configured in settings"""
+    if settings.database_null_pool:
+        return {"poolclass": metrics.InstrumentedNullPool, "pool_pre_ping": settings.database_pool_pre_ping}
+
+    return {
+        "poolclass": queue_pool_class,
+        "pool_size": settings.database_pool_size,
+        "max_overflow": settings.database_max_overflow,
+        "pool_timeout": settings.database_pool_timeout,
+        "pool_recycle": settings.database_pool_recycle,
+        "pool_pre_ping": settings.database_pool_pre_ping,
+    }
+
 # Create the SQLAlchemy engine
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **pool_options(metrics.InstrumentedQueuePool))
+metrics.register_pool("primary", engine)
 
 # Create a session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Opt-in async engine on the asyncpg driver, only built when DATABASE_ASYNC is enabled
+SQLALCHEMY_ASYNC_DATABASE_URL = f"postgresql+asyncpg://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
+
+async_engine = None
+if settings.database_async:
+    async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, **pool_options(metrics.InstrumentedAsyncAdaptedQueuePool))
+    metrics.register_pool("primary_async", async_engine.sync_engine)
+
+# Objects are not expired on commit, since reloading them would need an implicit await
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=async_engine)
+
 # Base class for models
 Base = declarative_base()
 
+
+# Read replicas
+
+class ReplicaSet:
+    """
+    Round-robin over the replica engines. A replica that fails to hand out a connection
+    is skipped for `retry_after` seconds, after which the next read tries it again.
+    """
+
+    def __init__(self, engines, retry_after: float):
+        self.engines = engines
+        self.retry_after = retry_after
+        self._turn = itertools.count()
+        self._down_until = {}
+
+    def candidates(self):
+        """Healthy replicas, starting from the next one in turn"""
+        if not self.engines:
+            return []
+        start = next(self._turn) % len(self.engines)
+        now = time.monotonic()
+        return [
+            engine for engine in self.engines[start:] + self.engines[:start]
+            if self._down_until.get(engine, 0) <= now
+        ]
+
+    def mark_down(self, engine):
+        logger.warning("Read replica %s is unavailable, retrying it in %ss", engine.url.host, self.retry_after, exc_info=True)
+        self._down_until[engine] = time.monotonic() + self.retry_after
+
+
+class ReplicaSession(Session):
+    """
+    Session of the read-only routes. It picks a replica when its first statement runs rather
+    than when it is created, so a request answered from the response cache checks out no
+    connection. A replica that cannot hand out a connection is marked down and the next one
+    tried, then the primary.
+    """
+
+    def __init__(self, replica_set: ReplicaSet, primary, **kw):
+        super().__init__(**kw)
+        self.replica_set = replica_set
+        self.primary = primary
+
+    def get_bind(self, mapper=None, **kw):
+        if self.bind is None:
+            self.bind = self._pick_bind()
+        return self.bind
+
+    def _pick_bind(self):
+        for replica in self.replica_set.candidates():
+            # Async engines are driven through their sync engine, from inside the greenlet
+            bind = getattr(replica, "sync_engine", replica)
+            try:
+                self.connection(bind_arguments={"bind": bind})
+            # asyncpg raises the refused connection as a plain OSError
+            except (exc.DBAPIError, OSError):
+                self.close()
+                self.replica_set.mark_down(replica)
+                continue
+            return bind
+        return self.primary
+
+    @property
+    def on_replica(self) -> bool:
+        return self.bind is not None and self.bind is not self.primary
+
+
+def read_from_replica(db) -> bool:
+    """Whether a session's reads went to a replica, which may not have applied the latest writes"""
+    return getattr(getattr(db, "sync_session", db), "on_replica", False)
+
+
+replica_engines = []
+for number, url in enumerate(settings.database_replica_urls):
+    replica_engines.append(create_engine(url, **pool_options(metrics.InstrumentedQueuePool)))
+    metrics.register_pool(f"replica{number}", replica_engines[-1])
+
+replicas = ReplicaSet(replica_engines, settings.database_replica_retry_seconds)
+
+async_replicas = ReplicaSet([], settings.database_replica_retry_seconds)
+if settings.database_async:
+    for number, url in enumerate(settings.database_replica_urls):
+        replica = create_async_engine(make_url(url).set(drivername="postgresql+asyncpg"), **pool_options(metrics.InstrumentedAsyncAdaptedQueuePool))
+        metrics.register_pool(f"replica{number}_async", replica.sync_engine)
+        async_replicas.engines.append(replica)
+
+
+# Access tokens that committed a write lately, whose reads stay on the primary until the replicas catch up
+recent_writers = make_cache("recent_writers", maxsize=10000, ttl=settings.read_your_writes_seconds)
+
+
+@event.listens_for(Session, "after_commit")
+def remember_commit(session):
+    session.info["committed"] = True
+
+
+def writer_key(request: Request):
+    authorization = request.headers.get("authorization")
+    return hashlib.sha256(authorization.encode()).hexdigest() if authorization else None
+
+
+def remember_writer(request: Request, session: Session):
+    if settings.read_your_writes_seconds and session.info.get("committed"):
+        key = writer_key(request)
+        if key:
+            recent_writers.set(key, True)
+
+
+def reads_from_primary(request: Request) -> bool:
+    if not settings.read_your_writes_seconds:
+        return False
+    key = writer_key(request)
+    return key is not None and recent_writers.get(key) is not None
+
+
+# A session only checks a connection out of the pool when its first statement runs, and hands
+# it back on commit. Reads never commit, so a handler calls `release` once it has the rows it
+# needs, or the connection stays out through formatting, bcrypt and response serialization.
+# Objects already loaded stay readable; the session checks out a new connection if used again.
+
+def release(db: Session):
+    db.close()
+
+
+async def release_async(db: AsyncSession):
+    await db.close()
+
+
 # Dependency to get a database session
-def get_db():
+def get_db(request: Request):
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+        remember_writer(request, db)
+
+# Dependency for read-only routes: a session on a replica, or on the primary when none can serve
+def get_read_db(request: Request):
+    if not reads_from_primary(request) and replicas.engines:
+        with ReplicaSession(replicas, primary=SessionLocal.kw["bind"], autoflush=False) as db:
+            yield db
+        return
+
+    yield from get_db(request)
+
+# Async dependency to get a database session
+async def get_async_db(request: Request):
+    async with AsyncSessionLocal() as db:
+        yield db
+        remember_writer(request, db.sync_session)
+
+# Async dependency for read-only routes, see get_read_db
+async def get_async_read_db(request: Request):
+    if not reads_from_primary(request) and async_replicas.engines:
+        primary = AsyncSessionLocal.kw["bind"].sync_engine
+        async with AsyncSessionLocal(bind=None, sync_session_class=ReplicaSession, replica_set=async_replicas, primary=primary) as db:
+            yield db
+        return
+
+    async with AsyncSessionLocal() as db:
+        yield db
 
 
 # Connect to PostgreSQL database for psycopg2 (to run RAW SQL QUERY)
@@ -0,0 +1,154 @@
+"""
+Opt-in per-request timing, enabled with REQUEST_TIMING_ENABLED.
+
+TimingMiddleware measures each request, the SQLAlchemy hooks add up the statements
+it runs and their time, and `timed` measures a dependency such as get_current_principal.
+The results go out as a Server-Timing header and as histograms on GET /metrics,
+labelled by route template. SLOW_QUERY_MS logs any statement slower than that,
+with or without the middleware.
+"""
+import functools
+import inspect
+import logging
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+
+from app import metrics
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUERY_COUNT_BUCKETS = [0, 1, 2, 3, 5, 10, 25, 50, 100]
+
+REQUEST_SECONDS = metrics.Histogram("http_request_duration_seconds", "Time to the end of the response", LATENCY_BUCKETS)
+DB_SECONDS = metrics.Histogram("http_request_db_seconds", "Time spent executing SQL per request", LATENCY_BUCKETS)
+DB_QUERIES = metrics.Histogram("http_request_db_queries", "SQL statements executed per request", QUERY_COUNT_BUCKETS)
+AUTH_SECONDS = metrics.Histogram("http_request_auth_seconds", "Time spent authenticating the caller per request", LATENCY_BUCKETS)
+
+
+class RequestTiming:
+    __slots__ = ("start", "queries", "db_seconds", "phases")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        # Named spans measured by `timed`, in seconds
+        self.phases = {}
+
+    def server_timing(self) -> str:
+        total = time.perf_counter() - self.start
+        entries = [f"app;dur={total * 1000:.1f}", f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries"']
+        entries += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items()]
+        return ", ".join(entries)
+
+
+# Timing of the request being served. Sync handlers and dependencies run in worker
+# threads with a copy of the context, which still points at the same RequestTiming
+current_timing: ContextVar[RequestTiming | None] = ContextVar("current_timing", default=None)
+
+
+class TimingMiddleware:
+    """Pure ASGI middleware, so streaming responses are not buffered on their way out"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("Server-Timing", timing.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timing.reset(token)
+            route = scope.get("route")
+            labels = {
+                "method": scope["method"],
+                # The template keeps /posts/1 and /posts/2 in one series
+                "route": route.path if route is not None else "unmatched",
+                "status": status_code,
+            }
+            REQUEST_SECONDS.observe(time.perf_counter() - timing.start, **labels)
+            DB_SECONDS.observe(timing.db_seconds, **labels)
+            DB_QUERIES.observe(timing.queries, **labels)
+            if "auth" in timing.phases:
+                AUTH_SECONDS.observe(timing.phases["auth"], **labels)
+
+
+def timed(name: str):
+    """Adds the time spent in the decorated function, sync or async, to the request's `name` phase"""
+
+    def record(start: float):
+        timing = current_timing.get()
+        if timing is not None:
+            timing.phases[name] = timing.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    record(start)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    record(start)
+        return wrapper
+
+    return decorate
+
+
+# SQL statements
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"]
+
+    timing = current_timing.get()
+    if timing is not None:
+        timing.queries += 1
+        timing.db_seconds += elapsed
+
+    if settings.slow_query_ms and elapsed * 1000 >= settings.slow_query_ms:
+        logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+
+
+def instrument_engines():
+    """Hooks every engine, sync or async, current or future"""
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+
+if settings.request_timing_enabled:
+    metrics.collectors += [REQUEST_SECONDS.collect, DB_SECONDS.collect, DB_QUERIES.collect, AUTH_SECONDS.collect]
+
+if settings.request_timing_enabled or settings.slow_query_ms:
+    instrument_engines()
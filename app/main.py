@@ -1,13 +1,28 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.routers import post, user, auth, vote
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from app.config import settings
+from app.routers import post, user, auth, vote, metrics
 from fastapi.middleware.cors import CORSMiddleware
+from app.instrumentation import TimingMiddleware
+from app import metrics as app_metrics
+from app.vote_buffer import vote_buffer
 
 
 # Create database tables 
 # models.Base.metadata.create_all(bind=engine) # Now we longer need this command as we're working with alembic now for migration
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Write buffered votes before the worker exits
+    await run_in_threadpool(vote_buffer.stop)
+    app_metrics.log_process_summary()
+
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -20,13 +35,29 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
+# Per-worker request count on /metrics
+app.add_middleware(app_metrics.RequestCounter)
+
+if settings.request_timing_enabled:
+    # Added last so it is outermost and times everything else
+    app.add_middleware(TimingMiddleware)
+
+
+if settings.database_async:
+    # Registered first so the async handlers win over the sync ones on the same paths
+    app.include_router(post.async_router)
+    app.include_router(user.async_router)
+    app.include_router(auth.async_router)
+    app.include_router(vote.async_router)
 
 app.include_router(post.router)
 app.include_router(user.router)
 app.include_router(auth.router)
 app.include_router(vote.router)
+app.include_router(metrics.router)
 
 
 @app.get("/")
@@ -0,0 +1,47 @@
+"""
+One-shot maintenance commands
+
+    python -m app.maintenance reconcile-votes
+"""
+import argparse
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.database import SessionLocal
+
+
+def reconcile_vote_counts(db: Session) -> int:
+    """
+    Recompute posts.vote_count from the votes table and return how many posts had drifted.
+    Also serves as the backfill for rows written before the counter existed.
+    """
+    counted = select(func.count(models.Vote.post_id)) \
+        .where(models.Vote.post_id == models.Post.id) \
+        .scalar_subquery()
+
+    result = db.execute(
+        update(models.Post)
+        .where(models.Post.vote_count != counted)
+        .values(vote_count=counted)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+    return result.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app.maintenance")
+    parser.add_argument("command", choices=["reconcile-votes"])
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        if args.command == "reconcile-votes":
+            fixed = reconcile_vote_counts(db)
+            print(f"Reconciled vote_count on {fixed} post(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Per-process metrics, exposed in the Prometheus text format on GET /metrics.
+
+Every worker keeps its own numbers, so each sample carries a `pid` label.
+"""
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+# Callables returning lines of the exposition format, rendered in order
+collectors = []
+
+
+def render() -> str:
+    lines = []
+    for collect in collectors:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
+
+
+def format_labels(**labels) -> str:
+    labels["pid"] = os.getpid()
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+class Histogram:
+    """Prometheus histogram, one series per distinct set of labels"""
+
+    def __init__(self, name: str, help: str, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self._lock = threading.Lock()
+        # labels -> [count per bucket..., sum, count]
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in self._series.items():
+                labels = dict(key)
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{{{format_labels(**labels, le=bound)}}} {count}")
+                lines.append(f"{self.name}_bucket{{{format_labels(**labels, le='+Inf')}}} {series[-1]}")
+                lines.append(f"{self.name}_sum{{{format_labels(**labels)}}} {series[-2]}")
+                lines.append(f"{self.name}_count{{{format_labels(**labels)}}} {series[-1]}")
+        return lines
+
+
+# Connection pool
+
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        # Connections handed out right now, the most at once, and how long they were kept
+        self.checked_out = 0
+        self.checked_out_max = 0
+        self.held_seconds_total = 0.0
+        self.held_seconds_max = 0.0
+
+    def observe(self, waited: float, timed_out: bool = False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def checked_out_connection(self):
+        with self.lock:
+            self.checked_out += 1
+            self.checked_out_max = max(self.checked_out_max, self.checked_out)
+
+    def checked_in_connection(self, held: float):
+        with self.lock:
+            self.checked_out -= 1
+            self.held_seconds_total += held
+            self.held_seconds_max = max(self.held_seconds_max, held)
+
+
+class InstrumentedPoolMixin:
+    """Times every checkout (queue wait, connect and pre-ping) and counts checkout timeouts"""
+
+    stats = None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.observe(time.perf_counter() - start, timed_out=True)
+            logger.warning("Connection pool checkout timed out: %s", self.status())
+            raise
+        self.stats.observe(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() swaps the pool out, keep counting into the same stats
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+class InstrumentedNullPool(InstrumentedPoolMixin, NullPool):
+    pass
+
+
+# Engines whose pools are reported, by name
+pools = {}
+
+POOL_METRICS = [
+    # name, type, help, value, only meaningful for queue pools
+    ("db_pool_checkouts_total", "counter", "Connections checked out of the pool", lambda pool: pool.stats.checkouts, False),
+    ("db_pool_checkout_timeouts_total", "counter", "Checkouts that gave up after pool_timeout", lambda pool: pool.stats.timeouts, False),
+    ("db_pool_checkout_wait_seconds_total", "counter", "Time spent waiting for a connection", lambda pool: pool.stats.wait_seconds_total, False),
+    ("db_pool_checkout_wait_seconds_max", "gauge", "Longest single checkout wait", lambda pool: pool.stats.wait_seconds_max, False),
+    ("db_pool_checked_out_max", "gauge", "Most connections checked out at once", lambda pool: pool.stats.checked_out_max, False),
+    ("db_pool_held_seconds_total", "counter", "Time connections spent checked out", lambda pool: pool.stats.held_seconds_total, False),
+    ("db_pool_held_seconds_max", "gauge", "Longest a connection stayed checked out", lambda pool: pool.stats.held_seconds_max, False),
+    ("db_pool_size", "gauge", "Configured pool_size", lambda pool: pool.size(), True),
+    ("db_pool_checked_out", "gauge", "Connections currently checked out", lambda pool: pool.checkedout(), True),
+    ("db_pool_overflow", "gauge", "Connections opened beyond pool_size", lambda pool: max(pool.overflow(), 0), True),
+]
+
+
+def register_pool(name: str, engine):
+    """Start reporting an engine built with one of the instrumented pool classes"""
+    engine.pool.stats = PoolStats()
+    pools[name] = engine
+
+    # How long each connection stays out of the pool, from the request's first statement to its release
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+        engine.pool.stats.checked_out_connection()
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            engine.pool.stats.checked_in_connection(time.perf_counter() - checked_out_at)
+
+
+def collect_pools():
+    lines = []
+    for metric, kind, help, value, queue_only in POOL_METRICS:
+        lines += [f"# HELP {metric} {help}", f"# TYPE {metric} {kind}"]
+        for name, engine in pools.items():
+            pool = engine.pool
+            if queue_only and not isinstance(pool, QueuePool):
+                continue
+            lines.append(f"{metric}{{{format_labels(pool=name)}}} {value(pool)}")
+    return lines
+
+
+def reset_pools():
+    """
+    Run in a freshly forked worker: forgets connections inherited from the parent without
+    closing them, since they still belong to it, and starts the pool statistics over
+    """
+    for engine in pools.values():
+        engine.dispose(close=False)
+        engine.pool.stats = PoolStats()
+
+
+collectors.append(collect_pools)
+
+
+# Process
+
+class RequestCounter:
+    """Pure ASGI middleware counting the HTTP requests served by this worker"""
+
+    requests = 0
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            RequestCounter.requests += 1
+        await self.app(scope, receive, send)
+
+
+def resident_memory_bytes():
+    # Includes pages still shared copy-on-write with the server's master process
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def collect_process():
+    times = os.times()
+    lines = [
+        "# HELP http_requests_total HTTP requests served by this worker",
+        "# TYPE http_requests_total counter",
+        f"http_requests_total{{{format_labels()}}} {RequestCounter.requests}",
+        "# HELP process_cpu_seconds_total User and system CPU time",
+        "# TYPE process_cpu_seconds_total counter",
+        f"process_cpu_seconds_total{{{format_labels()}}} {times.user + times.system}",
+    ]
+    rss = resident_memory_bytes()
+    if rss is not None:
+        lines += [
+            "# HELP process_resident_memory_bytes Resident memory of the worker process",
+            "# TYPE process_resident_memory_bytes gauge",
+            f"process_resident_memory_bytes{{{format_labels()}}} {rss}",
+        ]
+    return lines
+
+
+def log_process_summary():
+    rss = resident_memory_bytes()
+    logger.info(
+        "Process %s served %d requests, resident memory %s MiB",
+        os.getpid(), RequestCounter.requests, "?" if rss is None else round(rss / 2**20, 1),
+    )
+
+
+collectors.append(collect_process)
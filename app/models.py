@@ -1,6 +1,7 @@
 from .database import Base
-from sqlalchemy import TIMESTAMP, Column, ForeignKey, Integer, String, Boolean, text
-from sqlalchemy.orm import relationship
+from sqlalchemy import DDL, TIMESTAMP, Column, Computed, ForeignKey, Index, Integer, String, Boolean, event, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
 
 class Post(Base):
     __tablename__ = "posts"
@@ -11,9 +12,23 @@ class Post(Base):
     published = Column(Boolean, server_default='TRUE', nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
     owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # Denormalized count of votes, maintained by the votes_vote_count trigger below
+    vote_count = Column(Integer, nullable=False, server_default='0')
+    # Full-text document for ?search=, generated by Postgres and never loaded unless asked for
+    search_vector = deferred(Column(TSVECTOR, Computed("to_tsvector('english', title || ' ' || content)", persisted=True)))
 
     owner = relationship("User")
 
+    __table_args__ = (
+        # Keyset pagination for GET /posts walks this index backwards
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        Index("ix_posts_search_vector", "search_vector", postgresql_using="gin"),
+        # ?order_by=top
+        Index("ix_posts_vote_count_id", "vote_count", "id"),
+        # Per-owner feeds, newest first, also used by cascading deletes of users and exports filtered by owner
+        Index("ix_posts_owner_id_created_at_id", "owner_id", "created_at", "id"),
+    )
+
 
 class User(Base):
     __tablename__ = "users"
@@ -29,4 +44,28 @@ class Vote(Base):
     __tablename__ = "votes"
 
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
-    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
\ No newline at end of file
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+
+    __table_args__ = (
+        # The primary key leads with user_id, this one serves lookups by post (cascades, recounts)
+        Index("ix_votes_post_id", "post_id"),
+    )
+
+
+# Mirror of the trigger shipped in the 772ae2df86d9 migration, so that
+# metadata.create_all() (used by the test suite) builds the same schema
+event.listen(Vote.__table__, "after_create", DDL("""
+CREATE OR REPLACE FUNCTION posts_vote_count_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE posts SET vote_count = vote_count + 1 WHERE id = NEW.post_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE posts SET vote_count = vote_count - 1 WHERE id = OLD.post_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER votes_vote_count AFTER INSERT OR DELETE ON votes
+FOR EACH ROW EXECUTE FUNCTION posts_vote_count_trg();
+"""))
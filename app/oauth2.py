@@ -2,12 +2,19 @@ from fastapi import Depends, HTTPException, status
 import jwt
 from jwt.exceptions import PyJWTError
 import datetime
+import hashlib
+import time
 from datetime import timedelta
+from functools import lru_cache
 
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app import models
+from app.cache import make_cache
 from app.database import get_db
-from app.schemas import TokenData
+from app.instrumentation import timed
+from app.schemas import TokenData, UserOut
 from fastapi.security import OAuth2PasswordBearer
 from app.config import settings
 
@@ -25,6 +32,55 @@ ALGORITHM = settings.algorithm
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 
 
+# Claims of tokens that already passed verification, until the token's own exp
+token_cache = make_cache("tokens", maxsize=settings.token_cache_size, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+@lru_cache(maxsize=4)
+def key_generation(secret_key: str) -> str:
+    return hashlib.sha256(secret_key.encode()).hexdigest()[:16]
+
+
+def token_cache_key(token: str) -> str:
+    # Scoped to the signing key, so rotating SECRET_KEY never serves claims verified with the old one
+    return f"{key_generation(SECRET_KEY)}:{hashlib.sha256(token.encode()).hexdigest()}"
+
+
+# Users rows needed for authorization, by id, so protected routes skip the users lookup
+user_cache = make_cache("users", maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl)
+
+
+def cache_user(user: models.User):
+    row = {"id": user.id, "email": user.email, "created_at": user.created_at.isoformat()}
+    user_cache.set(user.id, row)
+    return row
+
+
+def user_from_row(row) -> UserOut:
+    # Trusted data straight from the users table, no need to validate it again
+    return UserOut.model_construct(id=row["id"], email=row["email"], created_at=datetime.datetime.fromisoformat(row["created_at"]))
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def invalidate_cached_user(mapper, connection, target):
+    user_cache.delete(target.id)
+
+
+# Users whose tokens must stop working before they expire, checked by get_current_principal
+# when TOKEN_REVOCATION_ENABLED. Ids only, each kept as long as a token issued before could live
+revoked_users = make_cache("revoked_users", maxsize=settings.revoked_users_size, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+def revoke_user_tokens(user_id: int):
+    revoked_users.set(user_id, True)
+
+
+@event.listens_for(models.User, "after_delete")
+def revoke_deleted_user(mapper, connection, target):
+    revoke_user_tokens(target.id)
+
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     to_encode["user_id"] = str(to_encode["user_id"])  # Ensure user_id is a string
@@ -36,28 +92,101 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 
-def verify_access_token(token: str, credentials_exceptions):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=ALGORITHM)
-        id = payload.get("user_id")
+def decode_access_token(token: str, credentials_exceptions) -> dict:
+    """Claims of a valid token, verified once and then served from token_cache"""
+    cache_key = token_cache_key(token)
+    payload = token_cache.get(cache_key)
 
-        if id is None:
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=ALGORITHM)
+        except PyJWTError as e:
             raise credentials_exceptions
 
-        token_data = TokenData(id=str(id))  # Convert id to string
-    except PyJWTError as e:
-        raise credentials_exceptions
+        if payload.get("user_id") is None:
+            raise credentials_exceptions
+
+        ttl = payload.get("exp", 0) - time.time()
+        if ttl > 0:
+            token_cache.set(cache_key, payload, ttl=ttl)
+
+    return payload
+
+
+def verify_access_token(token: str, credentials_exceptions):
+    payload = decode_access_token(token, credentials_exceptions)
+
+    # Claims come from a verified token, no need to validate them again
+    token_data = TokenData.model_construct(id=str(payload["user_id"]))  # Convert id to string
 
     return token_data
 
-    
+
+class Principal:
+    """
+    The caller as stated by its verified access token. Carries no users row: handlers
+    that only need the id skip the session and the users lookup of get_current_user
+    """
+    __slots__ = ("id", "claims")
+
+    def __init__(self, id: int, claims: dict):
+        self.id = id
+        # Shared with token_cache, treat as read-only
+        self.claims = claims
+
+    def __repr__(self):
+        return f"Principal(id={self.id})"
+
+
+def credentials_exception():
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                         detail=f"Could not validate credentials",
+                         headers={"WWW-Authenticate": "Bearer"})
+
+
+@timed("auth")
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    # async def without any I/O: runs on the event loop, so sync routes skip a thread hop for it too
+    claims = decode_access_token(token, credentials_exception())
+    user_id = int(claims["user_id"])
+
+    if settings.token_revocation_enabled and revoked_users.get(user_id) is not None:
+        raise credentials_exception()
+
+    return Principal(user_id, claims)
+
+
+# A principal's users row may have been deleted since its token was issued. Routes that write
+# rows referencing users find out from the foreign key instead of a lookup on every request,
+# and answer 401 as get_current_user would have
+
+def select_user_exists(user_id: int):
+    return select(models.User.id).filter(models.User.id == user_id)
+
+
+def user_gone(db: Session, user_id: int) -> bool:
+    """Called after a write failed its integrity checks, whether the caller's users row is missing"""
+    db.rollback()
+    return db.execute(select_user_exists(user_id)).first() is None
+
+
+async def user_gone_async(db: AsyncSession, user_id: int) -> bool:
+    await db.rollback()
+    return (await db.execute(select_user_exists(user_id))).first() is None
+
+
+@timed("auth")
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                                          detail=f"Could not validate credentials", 
-                                          headers={"WWW-Authenticate": "Bearer"})
-    
-    token = verify_access_token(token, credentials_exception)
+    credentials = credentials_exception()
+
+    token = verify_access_token(token, credentials)
+    user_id = int(token.id)
 
-    user = db.query(models.User).filter(models.User.id == token.id).first()
+    row = user_cache.get(user_id)
+    if row is None:
+        user = db.query(models.User).filter(models.User.id == user_id).first()
+        if user is None:
+            raise credentials
+        row = cache_user(user)
 
-    return user
\ No newline at end of file
+    return user_from_row(row)
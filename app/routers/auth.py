@@ -1,13 +1,18 @@
 from fastapi import APIRouter, Depends, status, HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app import models, oauth2
-from app.database import get_db
+from app.database import get_async_db, get_db, release, release_async
 from app.schemas import Token
-from app.utils import verify
+from app.utils import verify_and_update, verify_and_update_async
 from fastapi.security import OAuth2PasswordRequestForm
 
 router = APIRouter(tags=['Authentication'])
 
+# async def version of the route below, mounted ahead of `router` when DATABASE_ASYNC is enabled
+async_router = APIRouter(tags=['Authentication'])
+
 @router.post('/login', response_model=Token)
 def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """
@@ -32,13 +37,21 @@ def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session =
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Invalid credentials"
         )
+    # bcrypt takes far longer than the lookup, so the connection goes back to the pool first
+    release(db)
     
     # Verify password
-    if not verify(password, user.password):
+    verified, new_hash = verify_and_update(password, user.password)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Invalid credentials"
         )
+
+    # Transparently move the stored hash to the current work factor
+    if new_hash:
+        db.execute(update(models.User).filter(models.User.id == user.id).values(password=new_hash))
+        db.commit()
     
     # Generate access token with minimal payload
     access_token = oauth2.create_access_token(data={"user_id": user.id})
@@ -46,4 +59,46 @@ def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session =
     return {
         "access_token": access_token,
         "token_type": "bearer"
-    }
\ No newline at end of file
+    }
+
+
+@async_router.post('/login', response_model=Token)
+async def login_async(user_credentials: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    """
+    Authenticate user and return JWT token
+    """
+
+    if not user_credentials.username or not user_credentials.password:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Email and password are required"
+        )
+
+    email = user_credentials.username.strip().lower()
+    password = user_credentials.password.strip()
+
+    user = (await db.scalars(select(models.User).filter(models.User.email == email))).first()
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid credentials"
+        )
+    await release_async(db)
+
+    verified, new_hash = await verify_and_update_async(password, user.password)
+    if not verified:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid credentials"
+        )
+
+    if new_hash:
+        await db.execute(update(models.User).filter(models.User.id == user.id).values(password=new_hash))
+        await db.commit()
+
+    access_token = oauth2.create_access_token(data={"user_id": user.id})
+
+    return {
+        "access_token": access_token,
+        "token_type": "bearer"
+    }
@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app import metrics as app_metrics
+
+router = APIRouter(tags=['Metrics'])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Metrics of the worker process that served the request, in the Prometheus text format
+    """
+    return app_metrics.render()
@@ -1,66 +1,337 @@
-from fastapi import Response, status, HTTPException, Depends, APIRouter
-from sqlalchemy import func
+import csv
+import hashlib
+import io
+from datetime import datetime
+from fastapi import Query, Request, Response, status, HTTPException, Depends, APIRouter
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+import orjson
+from pydantic import ValidationError
+from sqlalchemy import cast, delete, func, insert, select, tuple_, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
 from app import models, oauth2
-from typing import List, Optional
+from app.cache import invalidate_posts, post_cache, post_list_generation, replicas_may_lag, response_cache_enabled
+from app.config import settings
+from typing import List, Literal, Optional
 
-from app.database import get_db
-from sqlalchemy.orm import Session
-from app.schemas import Post, PostCreate, PostOut
+from app.database import get_async_db, get_async_read_db, get_db, get_read_db, read_from_replica, release, release_async
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased, joinedload
+from app.schemas import BulkPostResult, Post, PostCreate, PostOut
+from app.utils import decode_cursor, encode_cursor
+from app.vote_buffer import vote_buffer
 
 router = APIRouter(
     prefix="/posts",
     tags=['Posts']
 )
 
+# async def versions of the routes below, mounted ahead of `router` when DATABASE_ASYNC is enabled
+async_router = APIRouter(
+    prefix="/posts",
+    tags=['Posts']
+)
+
+
+# Owners are joined into the post query, with just the columns UserOut needs,
+# instead of being lazy loaded one SELECT per distinct owner
+WITH_OWNER = joinedload(models.Post.owner).load_only(models.User.id, models.User.email, models.User.created_at)
+
 
 # Routes for post
 
+def parse_cursor(cursor: str, order_by: str, sort_keys):
+    try:
+        cursor_order, values = decode_cursor(cursor)
+        if cursor_order != order_by or len(values) != len(sort_keys):
+            raise ValueError("Cursor belongs to another ordering")
+        return [
+            datetime.fromisoformat(value) if key.type.python_type is datetime else key.type.python_type(value)
+            for key, value in zip(sort_keys, values)
+        ]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def select_posts(limit: int, skip: int, search: str, cursor: Optional[str], order_by: str = "newest", owner_id: Optional[int] = None):
+    """
+    Statement behind GET /posts and GET /users/{id}/posts, shared by the sync and async handlers.
+    Rows are (Post, *sort keys) so that the last one can be turned into the next cursor.
+    """
+    if order_by == "top":
+        # Most voted first, walking ix_posts_vote_count_id backwards
+        sort_keys = [models.Post.vote_count, models.Post.id]
+    else:
+        # Newest first, on ix_posts_created_at_id, or ix_posts_owner_id_created_at_id for one owner
+        sort_keys = [models.Post.created_at, models.Post.id]
+    stmt = select(models.Post).options(WITH_OWNER)
+
+    if owner_id is not None:
+        stmt = stmt.filter(models.Post.owner_id == owner_id)
+
+    if search:
+        # Full-text match on the generated tsvector column, served by its GIN index
+        ts_query = func.websearch_to_tsquery("english", search)
+        stmt = stmt.filter(models.Post.search_vector.op("@@")(ts_query))
+        if order_by == "relevance":
+            # ts_rank is a float4, widened so the value survives the round trip through the cursor exactly
+            sort_keys.insert(0, cast(func.ts_rank(models.Post.search_vector, ts_query), DOUBLE_PRECISION))
+
+    stmt = stmt.add_columns(*sort_keys).order_by(*[key.desc() for key in sort_keys])
+
+    if cursor:
+        # Keyset pagination: seek past the last row of the previous page instead of OFFSET
+        stmt = stmt.filter(tuple_(*sort_keys) < tuple(parse_cursor(cursor, order_by, sort_keys)))
+    else:
+        stmt = stmt.offset(skip)
+
+    # Fetch one extra row to know whether there is a next page
+    return stmt.limit(limit + 1)
+
+
+def post_row(post: models.Post):
+    """
+    PostOut["Post"] as plain data, read straight off an ORM row the database just returned.
+    Skips validating trusted data again; keys follow the field order of schemas.Post.
+    """
+    owner = post.owner
+    return {
+        "title": post.title,
+        "content": post.content,
+        "published": post.published,
+        "id": post.id,
+        "created_at": post.created_at,
+        "owner_id": post.owner_id,
+        "owner": {"id": owner.id, "email": owner.email, "created_at": owner.created_at},
+    }
+
+
+def vote_count(post: models.Post) -> int:
+    # Includes votes still waiting in the write-behind buffer, when VOTE_BUFFER_ENABLED
+    return post.vote_count + vote_buffer.delta(post.id)
+
+
+def dump_json(content) -> bytes:
+    # Same datetime format as pydantic's JSON output
+    return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
+
+def format_page(rows, limit: int, order_by: str):
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        # limit=0 asks for an empty page, which has no last row to continue from
+        if rows:
+            headers["X-Next-Cursor"] = encode_cursor(order_by, rows[-1][1:])
+
+    # Transform the results into the expected format
+    return [
+        {
+            "Post": post_row(row[0]),
+            "Votes": vote_count(row[0])
+        } for row in rows
+    ], headers
+
+
+def list_cache_key(limit: int, skip: int, search: str, cursor: Optional[str], order_by: str, owner_id: Optional[int] = None):
+    return f"list:{post_list_generation()}:{limit}:{skip}:{order_by}:{owner_id}:{cursor}:{search}"
+
+
+def cached_response(key: str):
+    return post_cache.get(key) if response_cache_enabled() else None
+
+
+def cache_response(key: str, content, headers=None, db=None):
+    """
+    Serialize a response once and keep it, with its ETag, for the next identical request.
+    `db` is the session the content was read with, unless it came from the primary
+    """
+    body = dump_json(content)
+    entry = {"etag": f'"{hashlib.sha1(body).hexdigest()}"', "body": body.decode(), "headers": headers or {}}
+    if response_cache_enabled() and not (db is not None and read_from_replica(db) and replicas_may_lag()):
+        post_cache.set(key, entry)
+    return entry
+
+
+def send_cached(request: Request, entry) -> Response:
+    # Clients must revalidate, which costs them a 304 without a body while nothing changed
+    headers = {"ETag": entry["etag"], "Cache-Control": "private, no-cache", **entry["headers"]}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if entry["etag"] in tags or "*" in tags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
+# Writes to a post check ownership in the statement itself, so the check and the write
+# are one round trip and nothing can change hands in between
+
+def update_owned_post(id: int, owner_id: int, values: dict):
+    """
+    UPDATE ... RETURNING in a CTE, selected back with the owner joined in, so the updated
+    post comes back ready for the response. No row when the post is missing or not owned.
+    """
+    updated = (
+        update(models.Post)
+        .filter(models.Post.id == id, models.Post.owner_id == owner_id)
+        .values(**values)
+        .returning(*models.Post.__table__.c)
+        .cte("updated")
+    )
+    post = aliased(models.Post, updated)
+    owner = joinedload(post.owner).load_only(models.User.id, models.User.email, models.User.created_at)
+    # Overwrite a copy of the post the session may already hold
+    return select(post).options(owner).execution_options(populate_existing=True)
+
+
+def delete_owned_post(id: int, owner_id: int):
+    return delete(models.Post).filter(models.Post.id == id, models.Post.owner_id == owner_id).returning(models.Post.id)
+
+
+def select_post_exists(id: int):
+    # Only run when a write matched no row, to tell a missing post from someone else's
+    return select(models.Post.id).filter(models.Post.id == id)
+
+
+def write_refused(id: int, exists: bool):
+    if not exists:
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id {id} was not found")
+    return HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform requested action")
+
+
+# Export
+
+EXPORT_FIELDS = ["id", "title", "content", "published", "created_at", "owner_id", "votes"]
+# Rows fetched per round trip from the server-side cursor, and written per chunk of the response
+EXPORT_BATCH_SIZE = 1000
+
+
+def select_export(search: str, owner_id: Optional[int], published: Optional[bool],
+                  created_after: Optional[datetime], created_before: Optional[datetime]):
+    stmt = select(
+        models.Post.id, models.Post.title, models.Post.content, models.Post.published,
+        models.Post.created_at, models.Post.owner_id, models.Post.vote_count,
+    ).order_by(models.Post.id)
+
+    if search:
+        stmt = stmt.filter(models.Post.search_vector.op("@@")(func.websearch_to_tsquery("english", search)))
+    if owner_id is not None:
+        stmt = stmt.filter(models.Post.owner_id == owner_id)
+    if published is not None:
+        stmt = stmt.filter(models.Post.published == published)
+    if created_after is not None:
+        stmt = stmt.filter(models.Post.created_at >= created_after)
+    if created_before is not None:
+        stmt = stmt.filter(models.Post.created_at < created_before)
+
+    # yield_per streams from a server-side cursor instead of buffering the whole result
+    return stmt.execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+def encode_export(rows, format: str) -> bytes:
+    if format == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(
+            [row.id, row.title, row.content, row.published, row.created_at.isoformat(), row.owner_id, row.vote_count]
+            for row in rows
+        )
+        return buffer.getvalue().encode()
+
+    return b"".join(dump_json(dict(zip(EXPORT_FIELDS, row))) + b"\n" for row in rows)
+
+
+def export_response(body, format: str) -> StreamingResponse:
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f"attachment; filename=posts.{format}"}
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+
+def stream_export(bind, stmt, format: str):
+    if format == "csv":
+        yield (",".join(EXPORT_FIELDS) + "\r\n").encode()
+
+    # The request's session is closed before the body is sent, so the stream opens its own
+    with Session(bind=bind) as db:
+        for rows in db.execute(stmt).partitions():
+            yield encode_export(rows, format)
+
+
+async def stream_export_async(bind, stmt, format: str):
+    if format == "csv":
+        yield (",".join(EXPORT_FIELDS) + "\r\n").encode()
+
+    async with AsyncSession(bind=bind) as db:
+        async for rows in (await db.stream(stmt)).partitions():
+            yield encode_export(rows, format)
+
+
 @router.get("/", response_model=List[PostOut])
 def get_posts(
-    db: Session = Depends(get_db), 
-    current_user: int = Depends(oauth2.get_current_user),
+    request: Request,
+    db: Session = Depends(get_read_db), 
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal),
     limit: int = 10,
-    skip: int = 0,
-    search: Optional[str] = ""
+    skip: int = Query(0, deprecated=True, description="Offset paging gets slower the deeper it goes, use `cursor` instead"),
+    search: Optional[str] = Query("", description="Full-text search over title and content"),
+    cursor: Optional[str] = Query(None, description="Value of the `X-Next-Cursor` header from the previous page"),
+    order_by: Literal["newest", "relevance", "top"] = Query("newest", description="`relevance` ranks matches when searching, `top` puts the most voted first"),
+    owner_id: Optional[int] = Query(None, description="Only posts of this user")
 ):
-    results = db.query(models.Post, func.count(models.Vote.post_id).label("votes")) \
-        .join(models.Vote, models.Vote.post_id == models.Post.id, isouter=True) \
-        .filter(models.Post.title.contains(search)) \
-        .group_by(models.Post.id) \
-        .limit(limit) \
-        .offset(skip) \
-        .all()
+    cache_key = list_cache_key(limit, skip, search, cursor, order_by, owner_id)
 
-    # Transform the results into the expected format
-    formatted_posts = [
-        {
-            "Post": post,
-            "Votes": votes if votes is not None else 0
-        } for post, votes in results
-    ]
+    entry = cached_response(cache_key)
+    if entry is None:
+        rows = db.execute(select_posts(limit, skip, search, cursor, order_by, owner_id)).all()
+        release(db)
+        page, headers = format_page(rows, limit, order_by)
+        entry = cache_response(cache_key, page, headers, db)
+
+    return send_cached(request, entry)
 
-    return formatted_posts
+
+@router.get("/export")
+def export_posts(
+    db: Session = Depends(get_read_db),
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal),
+    format: Literal["ndjson", "csv"] = "ndjson",
+    search: Optional[str] = Query("", description="Full-text search over title and content"),
+    owner_id: Optional[int] = None,
+    published: Optional[bool] = None,
+    created_after: Optional[datetime] = Query(None, description="Only posts created at or after this time"),
+    created_before: Optional[datetime] = Query(None, description="Only posts created before this time"),
+):
+    """
+    Every post matching the filters, streamed as NDJSON or CSV in id order.
+    Memory use stays flat whatever the table size.
+    """
+    stmt = select_export(search, owner_id, published, created_after, created_before)
+    return export_response(stream_export(db.get_bind(), stmt, format), format)
 
 
 @router.get("/{id}", response_model=PostOut)
-def get_post(id: int, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
-    result = db.query(models.Post, func.count(models.Vote.post_id).label("votes")) \
-        .join(models.Vote, models.Vote.post_id == models.Post.id, isouter=True) \
-        .filter(models.Post.id == id) \
-        .group_by(models.Post.id) \
-        .first()
-
-    if not result:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Post with id {id} was not found"
-        )
-    
-    return {"Post": result[0], "Votes": result[1] if result[1] is not None else 0}
+def get_post(id: int, request: Request, db: Session = Depends(get_read_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    entry = cached_response(f"post:{id}")
+    if entry is None:
+        post = db.query(models.Post).options(WITH_OWNER).filter(models.Post.id == id).first()
+        release(db)
+
+        if not post:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Post with id {id} was not found"
+            )
+
+        entry = cache_response(f"post:{id}", {"Post": post_row(post), "Votes": vote_count(post)}, db=db)
+
+    return send_cached(request, entry)
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=Post)
-def create_posts(post: PostCreate, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+def create_posts(post: PostCreate, db: Session = Depends(get_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
     # Prone to SQL Injection (The user can enter the SQL query directly into the values fields)
     # cursor.execute(f"INSERT INTO posts (title, content, published) VALUES ({post.title}, {post.content}, {post.published})") 
 
@@ -77,42 +348,125 @@ def create_posts(post: PostCreate, db: Session = Depends(get_db), current_user:
     # new_post = models.Post(title = post.title, content = post.content, published = post.published)  #Standard way
     new_post = models.Post(owner_id = current_user.id, **post.model_dump())  #Unpacking the dictionary using double star
     db.add(new_post)
+    try:
+        db.flush()  # Assigns the id
+    except IntegrityError:
+        if oauth2.user_gone(db, current_user.id):
+            raise oauth2.credentials_exception()
+        raise
+    post_id = new_post.id
     db.commit()
-    db.refresh(new_post)
+    invalidate_posts()
+
+    # Reload server defaults and the owner in one query
+    new_post = db.get(models.Post, post_id, options=[WITH_OWNER], populate_existing=True)
+    release(db)
     return new_post
 
+async def bulk_items(request: Request):
+    """
+    Yields (index, item) from a JSON array, or (index, raw line) from an NDJSON body,
+    which is read as it arrives so that a large import never sits in memory whole
+    """
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        index, buffer = 0, b""
+        async for chunk in request.stream():
+            *lines, buffer = (buffer + chunk).split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield index, line
+                    index += 1
+        if buffer.strip():
+            yield index, buffer
+        return
+
+    try:
+        items = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Body is not valid JSON")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a JSON array of posts")
+    for index, item in enumerate(items):
+        yield index, item
+
+
+def insert_batch(db: Session, batch, ids: list, errors: list):
+    """
+    Inserts a batch as one multi-row INSERT ... RETURNING in its own transaction.
+    When the database rejects it, the rows are retried one at a time so only the bad ones are reported.
+    """
+    stmt = insert(models.Post).returning(models.Post.id, sort_by_parameter_order=True)
+    try:
+        ids.extend(db.scalars(stmt, [values for _, values in batch]).all())
+        db.commit()
+        return
+    except IntegrityError:
+        # Every row fails its owner_id foreign key when the caller was deleted since its token was issued
+        if oauth2.user_gone(db, batch[0][1]["owner_id"]):
+            raise oauth2.credentials_exception()
+    except (SQLAlchemyError, ValueError):
+        db.rollback()
+
+    for index, values in batch:
+        try:
+            ids.append(db.scalars(stmt, [values]).one())
+            db.commit()
+        except (SQLAlchemyError, ValueError) as e:
+            db.rollback()
+            errors.append({"index": index, "detail": str(getattr(e, "orig", None) or e)})
+
+
+@router.post("/bulk", response_model=BulkPostResult)
+async def create_posts_bulk(request: Request, db: Session = Depends(get_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    """
+    Create many posts at once, from a JSON array or an NDJSON stream (Content-Type: application/x-ndjson).
+    Each batch of BULK_INSERT_BATCH_SIZE posts is committed on its own; invalid items are
+    reported by their position in the input and do not stop the rest of the load.
+    """
+    ids, errors, batch = [], [], []
+
+    async for index, item in bulk_items(request):
+        try:
+            if isinstance(item, bytes):
+                post = PostCreate.model_validate_json(item)
+            else:
+                post = PostCreate.model_validate(item)
+        except ValidationError as e:
+            errors.append({"index": index, "detail": e.errors(include_url=False, include_context=False, include_input=False)})
+            continue
+
+        batch.append((index, {"owner_id": current_user.id, **post.model_dump()}))
+        if len(batch) >= settings.bulk_insert_batch_size:
+            await run_in_threadpool(insert_batch, db, batch, ids, errors)
+            batch = []
+
+    if batch:
+        await run_in_threadpool(insert_batch, db, batch, ids, errors)
+
+    if ids:
+        invalidate_posts()
+
+    errors.sort(key=lambda error: error["index"])
+    return {"created": len(ids), "ids": ids, "errors": errors}
+
+
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_post(id: int, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+def delete_post(id: int, db: Session = Depends(get_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
     """
     Delete a post by ID
     """
-    # Query the post
-    post_query = db.query(models.Post).filter(models.Post.id == id)
-    post = post_query.first()
+    # Delete the post only if the user owns it
+    if db.execute(delete_owned_post(id, current_user.id)).first() is None:
+        raise write_refused(id, db.execute(select_post_exists(id)).first() is not None)
 
-    # Check if post exists
-    if post is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Post with id {id} was not found"
-        )
-    
-    # Check if user owns the post
-    if post.owner_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to perform requested action"
-        )
-    
-    # Delete the post using the query
-    post_query.delete(synchronize_session=False)
     db.commit()
+    invalidate_posts(id)
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @router.put("/{id}", response_model=Post)
-def update_post(id: int, updated_post: PostCreate, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+def update_post(id: int, updated_post: PostCreate, db: Session = Depends(get_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
     # cursor.execute(
     #     """ UPDATE posts SET title = %s, content = %s, published = %s WHERE id = %s RETURNING * """,
     #     (post.title, post.content, post.published, id)
@@ -120,20 +474,127 @@ def update_post(id: int, updated_post: PostCreate, db: Session = Depends(get_db)
     # updated_post = cursor.fetchone()
     # conn.commit()
 
-    post_query = db.query(models.Post).filter(models.Post.id == id)
-
-    post = post_query.first()
+    post = db.scalars(update_owned_post(id, current_user.id, updated_post.model_dump())).first()
 
     if post is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Post with id {id} was not found"
-        )
+        raise write_refused(id, db.execute(select_post_exists(id)).first() is not None)
 
-    if post.owner_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not Authorized to perform requested action")
-    
-    post_query.update(updated_post.model_dump(), synchronize_session=False)
+    # Read off before the commit expires it
+    content = post_row(post)
     db.commit()
-    
-    return post_query.first()
\ No newline at end of file
+    release(db)
+    invalidate_posts(id)
+
+    return content
+
+
+# Async routes for post
+
+@async_router.get("/", response_model=List[PostOut])
+async def get_posts_async(
+    request: Request,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal),
+    limit: int = 10,
+    skip: int = Query(0, deprecated=True, description="Offset paging gets slower the deeper it goes, use `cursor` instead"),
+    search: Optional[str] = Query("", description="Full-text search over title and content"),
+    cursor: Optional[str] = Query(None, description="Value of the `X-Next-Cursor` header from the previous page"),
+    order_by: Literal["newest", "relevance", "top"] = Query("newest", description="`relevance` ranks matches when searching, `top` puts the most voted first"),
+    owner_id: Optional[int] = Query(None, description="Only posts of this user")
+):
+    cache_key = list_cache_key(limit, skip, search, cursor, order_by, owner_id)
+
+    entry = cached_response(cache_key)
+    if entry is None:
+        rows = (await db.execute(select_posts(limit, skip, search, cursor, order_by, owner_id))).all()
+        await release_async(db)
+        page, headers = format_page(rows, limit, order_by)
+        entry = cache_response(cache_key, page, headers, db)
+
+    return send_cached(request, entry)
+
+
+@async_router.get("/export")
+async def export_posts_async(
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal),
+    format: Literal["ndjson", "csv"] = "ndjson",
+    search: Optional[str] = Query("", description="Full-text search over title and content"),
+    owner_id: Optional[int] = None,
+    published: Optional[bool] = None,
+    created_after: Optional[datetime] = Query(None, description="Only posts created at or after this time"),
+    created_before: Optional[datetime] = Query(None, description="Only posts created before this time"),
+):
+    """
+    Every post matching the filters, streamed as NDJSON or CSV in id order.
+    Memory use stays flat whatever the table size.
+    """
+    stmt = select_export(search, owner_id, published, created_after, created_before)
+    # A replica session has no bind until it picks one, which its first connection does
+    bind = (await db.connection()).engine
+    await release_async(db)
+    return export_response(stream_export_async(bind, stmt, format), format)
+
+
+@async_router.get("/{id}", response_model=PostOut)
+async def get_post_async(id: int, request: Request, db: AsyncSession = Depends(get_async_read_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    entry = cached_response(f"post:{id}")
+    if entry is None:
+        post = await db.get(models.Post, id, options=[WITH_OWNER])
+        await release_async(db)
+
+        if not post:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Post with id {id} was not found"
+            )
+
+        entry = cache_response(f"post:{id}", {"Post": post_row(post), "Votes": vote_count(post)}, db=db)
+
+    return send_cached(request, entry)
+
+
+@async_router.post("/", status_code=status.HTTP_201_CREATED, response_model=Post)
+async def create_posts_async(post: PostCreate, db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    new_post = models.Post(owner_id = current_user.id, **post.model_dump())
+    db.add(new_post)
+    try:
+        await db.commit()
+    except IntegrityError:
+        if await oauth2.user_gone_async(db, current_user.id):
+            raise oauth2.credentials_exception()
+        raise
+    invalidate_posts()
+
+    # Lazy loading is not available on AsyncSession, so server defaults and the owner are loaded here
+    new_post = await db.get(models.Post, new_post.id, options=[WITH_OWNER], populate_existing=True)
+    await release_async(db)
+    return new_post
+
+
+@async_router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_post_async(id: int, db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    """
+    Delete a post by ID
+    """
+    if (await db.execute(delete_owned_post(id, current_user.id))).first() is None:
+        raise write_refused(id, (await db.execute(select_post_exists(id))).first() is not None)
+
+    await db.commit()
+    invalidate_posts(id)
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@async_router.put("/{id}", response_model=Post)
+async def update_post_async(id: int, updated_post: PostCreate, db: AsyncSession = Depends(get_async_db), current_user: oauth2.Principal = Depends(oauth2.get_current_principal)):
+    post = (await db.scalars(update_owned_post(id, current_user.id, updated_post.model_dump()))).first()
+
+    if post is None:
+        raise write_refused(id, (await db.execute(select_post_exists(id))).first() is not None)
+
+    await db.commit()
+    await release_async(db)
+    invalidate_posts(id)
+
+    return post
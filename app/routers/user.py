@@ -1,16 +1,25 @@
-from fastapi import status, HTTPException, Depends, APIRouter
-from app import models
+from typing import List, Literal, Optional
+from fastapi import Query, Request, status, HTTPException, Depends, APIRouter
+from app import models, oauth2
 
-from app.utils import hash
-from app.database import get_db
+from app.utils import hash, hash_async
+from app.database import get_async_db, get_async_read_db, get_db, get_read_db, release, release_async
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.schemas import UserCreate, UserOut
+from app.routers.post import cache_response, cached_response, format_page, list_cache_key, select_posts, send_cached
+from app.schemas import PostOut, UserCreate, UserOut
 
 router = APIRouter(
     prefix="/users",
     tags=['Users']
 )
 
+# async def versions of the routes below, mounted ahead of `router` when DATABASE_ASYNC is enabled
+async_router = APIRouter(
+    prefix="/users",
+    tags=['Users']
+)
+
 # Routes for user
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=UserOut)
@@ -24,15 +33,100 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    release(db)
 
     return new_user
 
 
 @router.get('/{id}', response_model=UserOut)
-def get_user(id: int, db: Session = Depends(get_db)):
+def get_user(id: int, db: Session = Depends(get_read_db)):
     user = db.query(models.User).filter(models.User.id == id).first()
+    release(db)
 
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {id} does not exists")
     
-    return user
\ No newline at end of file
+    return user
+
+
+@router.get('/{id}/posts', response_model=List[PostOut])
+def get_user_posts(
+    id: int,
+    request: Request,
+    db: Session = Depends(get_read_db),
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal),
+    limit: int = 10,
+    cursor: Optional[str] = Query(None, description="Value of the `X-Next-Cursor` header from the previous page"),
+    order_by: Literal["newest", "top"] = Query("newest", description="`top` puts the most voted first")
+):
+    """
+    Posts of one user, paged with the same cursors as GET /posts
+    """
+    cache_key = f"user:{list_cache_key(limit, 0, '', cursor, order_by, id)}"
+
+    entry = cached_response(cache_key)
+    if entry is None:
+        rows = db.execute(select_posts(limit, 0, "", cursor, order_by, owner_id=id)).all()
+        # Only an empty page needs to tell a user without posts from a missing one
+        if not rows and db.get(models.User, id) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {id} does not exists")
+        release(db)
+        page, headers = format_page(rows, limit, order_by)
+        entry = cache_response(cache_key, page, headers, db)
+
+    return send_cached(request, entry)
+
+
+# Async routes for user
+
+@async_router.post("/", status_code=status.HTTP_201_CREATED, response_model=UserOut)
+async def create_user_async(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+
+    # Hash the password on the bcrypt pool without holding a thread
+    user.password = await hash_async(user.password)
+
+    new_user = models.User(**user.model_dump())
+    db.add(new_user)
+    await db.commit()
+    await db.refresh(new_user)
+    await release_async(db)
+
+    return new_user
+
+
+@async_router.get('/{id}', response_model=UserOut)
+async def get_user_async(id: int, db: AsyncSession = Depends(get_async_read_db)):
+    user = await db.get(models.User, id)
+    await release_async(db)
+
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {id} does not exists")
+
+    return user
+
+
+@async_router.get('/{id}/posts', response_model=List[PostOut])
+async def get_user_posts_async(
+    id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal),
+    limit: int = 10,
+    cursor: Optional[str] = Query(None, description="Value of the `X-Next-Cursor` header from the previous page"),
+    order_by: Literal["newest", "top"] = Query("newest", description="`top` puts the most voted first")
+):
+    """
+    Posts of one user, paged with the same cursors as GET /posts
+    """
+    cache_key = f"user:{list_cache_key(limit, 0, '', cursor, order_by, id)}"
+
+    entry = cached_response(cache_key)
+    if entry is None:
+        rows = (await db.execute(select_posts(limit, 0, "", cursor, order_by, owner_id=id))).all()
+        if not rows and await db.get(models.User, id) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {id} does not exists")
+        await release_async(db)
+        page, headers = format_page(rows, limit, order_by)
+        entry = cache_response(cache_key, page, headers, db)
+
+    return send_cached(request, entry)
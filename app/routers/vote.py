@@ -1,39 +1,218 @@
+from typing import List
 from fastapi import Response, status, HTTPException, Depends, APIRouter
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 from app import models
+from app.cache import invalidate_posts
+from app.config import settings
+from app.vote_buffer import vote_buffer
 
-from app.oauth2 import get_current_user
-from app.database import get_db
+from app.oauth2 import Principal, credentials_exception, get_current_principal, user_gone, user_gone_async
+from app.database import get_async_db, get_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.schemas import Vote
+from app.schemas import Vote, VoteResult
 
 router = APIRouter(
     prefix="/vote",
     tags=['Vote']
 )
 
+# async def version of the route below, mounted ahead of `router` when DATABASE_ASYNC is enabled
+async_router = APIRouter(
+    prefix="/vote",
+    tags=['Vote']
+)
+
+
+# Each vote is a single statement: the primary key turns a repeated vote into "no row returned"
+# and the foreign key turns a vote on a missing post into an IntegrityError, so neither needs a SELECT first
+
+def add_votes(user_id: int, post_ids):
+    return (
+        insert(models.Vote)
+        .values([{"post_id": post_id, "user_id": user_id} for post_id in post_ids])
+        .on_conflict_do_nothing()
+        .returning(models.Vote.post_id)
+    )
+
+
+def remove_votes(user_id: int, post_ids):
+    return (
+        delete(models.Vote)
+        .filter(models.Vote.user_id == user_id, models.Vote.post_id.in_(post_ids))
+        .returning(models.Vote.post_id)
+    )
+
+
+def lock_posts(post_ids):
+    # Every vote's trigger updates posts.vote_count, which would lock the posts in the order the batch
+    # lists them, and two batches over the same posts in different orders deadlock. Taking the row
+    # locks first, in id order, serializes them instead; FOR NO KEY UPDATE still lets votes reference the posts
+    return select(models.Post.id).filter(models.Post.id.in_(post_ids)).order_by(models.Post.id).with_for_update(key_share=True)
+
+
+def post_not_found(post_id: int):
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id: {post_id} does not exists")
+
+
+def vote_conflict(user_id: int, post_id: int):
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"user {user_id} has already voted on post {post_id}")
+
+
+def vote_not_found():
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Vote does not exists")
+
+
+def buffer_vote(vote: Vote, user_id: int, response: Response):
+    """
+    With VOTE_BUFFER_ENABLED the vote is only queued: it is checked against the post and
+    existing votes when written, so repeats and votes on missing posts are dropped then
+    """
+    vote_buffer.add(user_id, vote.post_id, vote.dir == 1)
+    invalidate_posts(vote.post_id)
+    response.status_code = status.HTTP_202_ACCEPTED
+    return {"message": "Vote Accepted"}
+
+
+def split_batch(votes: List[Vote]):
+    """Only the first vote per post in a batch is applied, returns (votes to add, votes to remove)"""
+    seen, adds, removes = set(), [], []
+    for vote in votes:
+        if vote.post_id not in seen:
+            seen.add(vote.post_id)
+            (adds if vote.dir == 1 else removes).append(vote.post_id)
+    return adds, removes
+
+
+def batch_results(votes: List[Vote], user_id: int, existing, added, removed):
+    results, seen = [], set()
+    for vote in votes:
+        if vote.post_id in seen:
+            error = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Post {vote.post_id} appears earlier in the batch")
+        elif vote.post_id not in existing:
+            error = post_not_found(vote.post_id)
+        elif vote.dir == 1:
+            error = None if vote.post_id in added else vote_conflict(user_id, vote.post_id)
+        else:
+            error = None if vote.post_id in removed else vote_not_found()
+        seen.add(vote.post_id)
+
+        if error is None:
+            message = "Voted Successfully" if vote.dir == 1 else "Vote Deleted Successfully"
+            results.append(VoteResult(post_id=vote.post_id, dir=vote.dir, status=status.HTTP_201_CREATED, detail=message))
+        else:
+            results.append(VoteResult(post_id=vote.post_id, dir=vote.dir, status=error.status_code, detail=error.detail))
+    return results
+
+
 @router.post("/", status_code=status.HTTP_201_CREATED)
-def vote(vote: Vote, db: Session = Depends(get_db), current_user: int = Depends(get_current_user)):
+def vote(vote: Vote, response: Response, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
 
-    post = db.query(models.Post).filter(models.Post.id == vote.post_id).first()
-    if not post:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Post with id: {vote.post_id} does not exists")
+    if settings.vote_buffer_enabled:
+        return buffer_vote(vote, current_user.id, response)
 
-    vote_query = db.query(models.Vote).filter(models.Vote.post_id == vote.post_id, models.Vote.user_id == current_user.id)
-    found_vote = vote_query.first()
-    
     if(vote.dir == 1):
-        if found_vote:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"user {current_user.id} has already voted on post {vote.post_id}")
-        
-        new_vote = models.Vote(post_id = vote.post_id, user_id = current_user.id)
-        db.add(new_vote)
+        try:
+            added = db.execute(add_votes(current_user.id, [vote.post_id])).first()
+        except IntegrityError:
+            if user_gone(db, current_user.id):
+                raise credentials_exception()
+            raise post_not_found(vote.post_id)
+        if added is None:
+            raise vote_conflict(current_user.id, vote.post_id)
+
         db.commit()
+        invalidate_posts(vote.post_id)
         return {"message": "Voted Successfully"}
-    else: 
-        if not found_vote:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Vote does not exists")
-        
-        vote_query.delete(synchronize_session=False)
+    else:
+        if db.execute(remove_votes(current_user.id, [vote.post_id])).first() is None:
+            raise vote_not_found()
+
         db.commit()
+        invalidate_posts(vote.post_id)
 
         return {"message": "Vote Deleted Successfully"}
+
+
+@router.post("/batch", response_model=List[VoteResult])
+def vote_batch(votes: List[Vote], db: Session = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
+    """
+    Apply many votes in one transaction, with a status per vote in the same order.
+    A failed vote does not stop the others; only the first vote per post is applied.
+    """
+    adds, removes = split_batch(votes)
+    existing = set(db.scalars(lock_posts(adds + removes))) if votes else set()
+
+    adds = [post_id for post_id in adds if post_id in existing]
+    removes = [post_id for post_id in removes if post_id in existing]
+    try:
+        # The posts are locked, only the caller's users row can be missing
+        added = set(db.scalars(add_votes(current_user.id, adds))) if adds else set()
+    except IntegrityError:
+        if user_gone(db, current_user.id):
+            raise credentials_exception()
+        raise
+    removed = set(db.scalars(remove_votes(current_user.id, removes))) if removes else set()
+
+    db.commit()
+    if added or removed:
+        invalidate_posts(*added, *removed)
+
+    return batch_results(votes, current_user.id, existing, added, removed)
+
+
+@async_router.post("/", status_code=status.HTTP_201_CREATED)
+async def vote_async(vote: Vote, response: Response, db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_principal)):
+
+    if settings.vote_buffer_enabled:
+        return buffer_vote(vote, current_user.id, response)
+
+    if(vote.dir == 1):
+        try:
+            added = (await db.execute(add_votes(current_user.id, [vote.post_id]))).first()
+        except IntegrityError:
+            if await user_gone_async(db, current_user.id):
+                raise credentials_exception()
+            raise post_not_found(vote.post_id)
+        if added is None:
+            raise vote_conflict(current_user.id, vote.post_id)
+
+        await db.commit()
+        invalidate_posts(vote.post_id)
+        return {"message": "Voted Successfully"}
+    else:
+        if (await db.execute(remove_votes(current_user.id, [vote.post_id]))).first() is None:
+            raise vote_not_found()
+
+        await db.commit()
+        invalidate_posts(vote.post_id)
+
+        return {"message": "Vote Deleted Successfully"}
+
+
+@async_router.post("/batch", response_model=List[VoteResult])
+async def vote_batch_async(votes: List[Vote], db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_principal)):
+    """
+    Apply many votes in one transaction, with a status per vote in the same order.
+    A failed vote does not stop the others; only the first vote per post is applied.
+    """
+    adds, removes = split_batch(votes)
+    existing = set(await db.scalars(lock_posts(adds + removes))) if votes else set()
+
+    adds = [post_id for post_id in adds if post_id in existing]
+    removes = [post_id for post_id in removes if post_id in existing]
+    try:
+        added = set(await db.scalars(add_votes(current_user.id, adds))) if adds else set()
+    except IntegrityError:
+        if await user_gone_async(db, current_user.id):
+            raise credentials_exception()
+        raise
+    removed = set(await db.scalars(remove_votes(current_user.id, removes))) if removes else set()
+
+    await db.commit()
+    if added or removed:
+        invalidate_posts(*added, *removed)
+
+    return batch_results(votes, current_user.id, existing, added, removed)
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Any, List, Optional
 from pydantic import BaseModel, EmailStr, Field, conint
 from datetime import datetime
 
@@ -41,6 +41,17 @@ class Post(PostBase):
         from_attributes = True
 
 
+class BulkPostError(BaseModel):
+    index: int
+    detail: Any
+
+
+class BulkPostResult(BaseModel):
+    created: int
+    ids: List[int]
+    errors: List[BulkPostError]
+
+
 class PostOut(BaseModel):
     Post: Post
     Votes: int
@@ -60,4 +71,11 @@ class TokenData(BaseModel):
 class Vote(BaseModel):
     post_id: int
     # dir: conint(le=1)
-    dir: int = Field(..., le=1)
\ No newline at end of file
+    dir: int = Field(..., le=1)
+
+
+class VoteResult(BaseModel):
+    post_id: int
+    dir: int
+    status: int
+    detail: str
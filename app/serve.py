@@ -0,0 +1,133 @@
+"""
+Production server: gunicorn supervising uvicorn workers on uvloop and httptools.
+
+    python -m app.serve
+
+The app is imported once in the master before the workers are forked, so they share
+its memory copy-on-write and a broken import fails the start instead of every worker.
+WEB_CONCURRENCY sets the number of workers, by default one per CPU this process may
+use, container CPU limits included. Each worker has its own connection pool, so the
+database sees up to WEB_CONCURRENCY x (DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW).
+
+Signals to the master process:
+
+    HUP         rolling restart: new workers start, then the old ones finish their
+                requests (up to GRACEFUL_TIMEOUT seconds) and exit. The code is not
+                reloaded, it was preloaded
+    USR2, TERM  deploy new code without dropping connections: USR2 starts a second
+                master on the same socket, TERM to the old master once it is up
+    TTIN, TTOU  one more, one fewer worker
+"""
+import logging
+import math
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+from uvicorn_worker import UvicornWorker
+
+from app import metrics
+from app.config import settings
+
+class Worker(UvicornWorker):
+    # Fail loudly instead of falling back to the pure Python loop and parser
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}
+
+
+def cgroup_cpu_limit(root: str = "/sys/fs/cgroup"):
+    """CPUs allowed by the container's CPU quota (docker --cpus, Kubernetes limits), None when unlimited"""
+    try:
+        # cgroup v2: "<quota> <period>", or "max <period>"
+        with open(os.path.join(root, "cpu.max")) as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+
+    try:
+        # cgroup v1, -1 when unlimited
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as f:
+            quota = int(f.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus(cgroup_root: str = "/sys/fs/cgroup") -> int:
+    try:
+        # The CPUs this process may be scheduled on, fewer than the machine's under taskset or cpusets
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    limit = cgroup_cpu_limit(cgroup_root)
+    if limit is not None:
+        cpus = min(cpus, math.ceil(limit))
+    return max(cpus, 1)
+
+
+def default_workers() -> int:
+    # One event loop per CPU: the sync handlers and bcrypt already run on threads within each worker
+    return settings.web_concurrency or available_cpus()
+
+
+# Server hooks, see https://docs.gunicorn.org/en/stable/settings.html#server-hooks
+
+def on_starting(server):
+    # USR2 re-executes the command line, which for `python -m` is the path of this file,
+    # where `app` would not be importable
+    server.START_CTX["args"] = [sys.executable, "-m", __spec__.name, *sys.argv[1:]]
+
+
+def post_fork(server, worker):
+    metrics.reset_pools()
+    # The app's loggers (slow queries, vote buffer, worker summary) write to gunicorn's error log
+    logger = logging.getLogger("app")
+    logger.handlers = worker.log.error_log.handlers
+    logger.setLevel(worker.log.error_log.level)
+    logger.propagate = False
+
+
+def options() -> dict:
+    workers = default_workers()
+    if workers > 1 and settings.response_cache_enabled and not settings.cache_redis_url:
+        # Each worker would go on serving its own copy of what another worker's write changed
+        sys.exit("RESPONSE_CACHE_ENABLED with more than one worker needs a shared CACHE_REDIS_URL")
+
+    return {
+        "bind": f"{settings.host}:{settings.port}",
+        "workers": workers,
+        "worker_class": Worker,
+        "preload_app": True,
+        "graceful_timeout": settings.graceful_timeout,
+        "max_requests": settings.max_requests,
+        # Spread out the restarts so the workers are not all replaced at once
+        "max_requests_jitter": settings.max_requests // 10,
+        "accesslog": "-",
+        "on_starting": on_starting,
+        "post_fork": post_fork,
+    }
+
+
+class Server(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app.main import app
+        from app.utils import password_context
+
+        # The app leaves passlib for the first login, load it here so the workers share it copy-on-write
+        password_context()
+        return app
+
+
+if __name__ == "__main__":
+    Server(options()).run()
@@ -1,9 +1,89 @@
-from passlib.context import CryptContext
+import asyncio
+import base64
+import json
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from fastapi import HTTPException, status
+from app.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated = "auto")
+@lru_cache
+def password_context():
+    # passlib is imported on the first hash, most requests and tools never need it
+    from passlib.context import CryptContext
+
+    # Pinning min/max to the configured work factor makes any other cost "need update", so
+    # changing BCRYPT_ROUNDS rehashes each password (up or down) on its next successful login
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated = "auto",
+        bcrypt__default_rounds=settings.bcrypt_rounds,
+        bcrypt__min_rounds=settings.bcrypt_rounds,
+        bcrypt__max_rounds=settings.bcrypt_rounds,
+    )
+
+
+# bcrypt runs on a dedicated, bounded pool so a login storm can't take every request thread.
+# Calls beyond the workers plus the queue are rejected straight away with a 503.
+_hasher_slots = threading.BoundedSemaphore(settings.password_hasher_workers + settings.password_hasher_queue_size)
+
+@lru_cache
+def hasher_executor():
+    if settings.password_hasher_processes:
+        return ProcessPoolExecutor(max_workers=settings.password_hasher_workers)
+    # bcrypt releases the GIL while hashing, so threads run in parallel too
+    return ThreadPoolExecutor(max_workers=settings.password_hasher_workers, thread_name_prefix="bcrypt")
+
+def submit_hasher(fn, *args) -> Future:
+    if not _hasher_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many password checks in progress, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        future = hasher_executor().submit(fn, *args)
+    except BaseException:
+        _hasher_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hasher_slots.release())
+    return future
+
+# Module level so they can be sent to a worker process
+def _hash(password: str):
+    return password_context().hash(password)
+
+def _verify_and_update(plain_password, hashed_password):
+    return password_context().verify_and_update(plain_password, hashed_password)
 
 def hash(password: str):
-    return pwd_context.hash(password)
+    return submit_hasher(_hash, password).result()
 
 def verify(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return verify_and_update(plain_password, hashed_password)[0]
+
+def verify_and_update(plain_password, hashed_password):
+    """Returns (verified, new_hash), new_hash is set when the stored hash uses an outdated work factor"""
+    return submit_hasher(_verify_and_update, plain_password, hashed_password).result()
+
+async def hash_async(password: str):
+    return await asyncio.wrap_future(submit_hasher(_hash, password))
+
+async def verify_and_update_async(plain_password, hashed_password):
+    return await asyncio.wrap_future(submit_hasher(_verify_and_update, plain_password, hashed_password))
+
+
+# Opaque pagination cursors: url-safe base64 of the ordering and the last row's sort keys
+def encode_cursor(order: str, values) -> str:
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    payload = json.dumps({"o": order, "k": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Returns (order, values), raises ValueError when the cursor was not produced by encode_cursor"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return payload["o"], list(payload["k"])
+    except (KeyError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
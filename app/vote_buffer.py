@@ -0,0 +1,153 @@
+"""
+Write-behind buffer for POST /vote, enabled with VOTE_BUFFER_ENABLED.
+
+Accepted votes are kept per (user_id, post_id), so a user flipping a vote back and forth
+costs one row change, and are written by a background thread in one transaction per
+flush, either every VOTE_BUFFER_INTERVAL seconds or once VOTE_BUFFER_SIZE votes are waiting.
+
+The buffer lives in the worker process: votes still waiting are lost if the process is
+killed without running the app shutdown, and other workers only see them once flushed.
+"""
+import logging
+import threading
+from collections import Counter
+
+from sqlalchemy import Integer, column, delete, select, tuple_, values
+from sqlalchemy.dialects.postgresql import insert
+
+from app import metrics, models
+from app.cache import invalidate_posts
+from app.config import settings
+from app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class VoteBuffer:
+    def __init__(self, size: int, interval: float, session_factory=SessionLocal):
+        self.size = size
+        self.interval = interval
+        self.session_factory = session_factory
+        self.flushed = 0
+        self.failed_flushes = 0
+        # (user_id, post_id) -> True to vote, False to take the vote back
+        self._pending = {}
+        # Expected change of each post's vote_count, for votes waiting or being written
+        self._deltas = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def add(self, user_id: int, post_id: int, up: bool):
+        with self._lock:
+            previous = self._pending.get((user_id, post_id))
+            if previous is not None:
+                self._deltas[post_id] -= 1 if previous else -1
+            self._pending[(user_id, post_id)] = up
+            self._deltas[post_id] += 1 if up else -1
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="vote-buffer", daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.size:
+                self._wakeup.set()
+
+    def delta(self, post_id: int) -> int:
+        """
+        Votes accepted for a post but not yet in posts.vote_count. An estimate: a vote
+        repeated, or taken back when it was never stored, counts until its flush
+        """
+        return self._deltas.get(post_id, 0)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self) -> int:
+        """Write every waiting vote in one transaction, returns how many were written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            adds = [(post_id, user_id) for (user_id, post_id), up in batch.items() if up]
+            removes = [(user_id, post_id) for (user_id, post_id), up in batch.items() if not up]
+            try:
+                with self.session_factory() as db:
+                    # Each vote's trigger updates its post, in whatever order Postgres reaches the rows. Locking
+                    # them first in id order, as POST /vote/batch does, keeps flushes from other workers from deadlocking
+                    post_ids = sorted({post_id for _, post_id in batch})
+                    db.execute(select(models.Post.id).filter(models.Post.id.in_(post_ids)).order_by(models.Post.id).with_for_update(key_share=True))
+                    if adds:
+                        # Votes on posts, or by users, deleted in the meantime are dropped by the joins instead of failing the batch
+                        pairs = values(column("post_id", Integer), column("user_id", Integer), name="pairs").data(adds)
+                        voters = (
+                            select(pairs.c.post_id, pairs.c.user_id)
+                            .join(models.Post, models.Post.id == pairs.c.post_id)
+                            .join(models.User, models.User.id == pairs.c.user_id)
+                        )
+                        db.execute(insert(models.Vote).from_select(["post_id", "user_id"], voters).on_conflict_do_nothing())
+                    if removes:
+                        db.execute(delete(models.Vote).filter(tuple_(models.Vote.user_id, models.Vote.post_id).in_(removes)))
+                    db.commit()
+            except Exception:
+                # Put the batch back behind anything accepted since, and try again on the next flush
+                with self._lock:
+                    for key, up in batch.items():
+                        if key in self._pending:
+                            # Voted again meanwhile: the newer vote replaces this one, and so does its delta
+                            self._deltas[key[1]] -= 1 if up else -1
+                    self._pending = {**batch, **self._pending}
+                    self.failed_flushes += 1
+                logger.exception("Flushing %d buffered votes failed", len(batch))
+                return 0
+
+            with self._lock:
+                for (user_id, post_id), up in batch.items():
+                    self._deltas[post_id] -= 1 if up else -1
+                    if not self._deltas[post_id]:
+                        del self._deltas[post_id]
+                self.flushed += len(batch)
+
+            invalidate_posts(*{post_id for _, post_id in batch})
+            return len(batch)
+
+    def stop(self):
+        """Stops the background thread and writes whatever is still waiting, called on app shutdown"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._stopping = False
+        self.flush()
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if not self._stopping:
+                self.flush()
+
+
+vote_buffer = VoteBuffer(settings.vote_buffer_size, settings.vote_buffer_interval)
+
+
+def collect_vote_buffer():
+    return [
+        "# HELP vote_buffer_pending Votes accepted but not yet written",
+        "# TYPE vote_buffer_pending gauge",
+        f"vote_buffer_pending{{{metrics.format_labels()}}} {len(vote_buffer)}",
+        "# HELP vote_buffer_flushed_total Buffered votes written to the database",
+        "# TYPE vote_buffer_flushed_total counter",
+        f"vote_buffer_flushed_total{{{metrics.format_labels()}}} {vote_buffer.flushed}",
+        "# HELP vote_buffer_failed_flushes_total Flushes that failed and were retried",
+        "# TYPE vote_buffer_failed_flushes_total counter",
+        f"vote_buffer_failed_flushes_total{{{metrics.format_labels()}}} {vote_buffer.failed_flushes}",
+    ]
+
+
+if settings.vote_buffer_enabled:
+    metrics.collectors.append(collect_vote_buffer)
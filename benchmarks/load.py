@@ -0,0 +1,270 @@
+"""
+Latency and throughput of the API under a mixed workload.
+
+Seeds users, posts and votes into a scratch database (dropped and recreated, the
+test database by default), then drives the real ASGI app in-process through httpx
+with concurrent clients, and reports p50/p95/p99 latency and req/s per endpoint.
+
+    python -m benchmarks.load --posts 5000 --requests 2000
+    python -m benchmarks.load --save-baseline benchmarks/baseline.json
+    python -m benchmarks.load --baseline benchmarks/baseline.json
+
+Compared to a baseline, the run fails when an endpoint's p95 is more than
+--tolerance slower. Baselines only mean something on the machine that recorded them.
+Server errors fail the run too, except 503: that is the password hasher turning logins
+away once its queue is full, counted in its own column and left out of the latencies.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+from sqlalchemy import create_engine, insert, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import metrics, models
+from app.config import settings
+from app.database import Base, SQLALCHEMY_DATABASE_URL, get_async_db, get_async_read_db, get_db, get_read_db, pool_options
+from app.main import app
+from app.oauth2 import create_access_token
+from app.utils import hash
+
+PASSWORD = "benchmark-password"
+WORDS = "fastapi postgres python vote cursor cache index replica worker search stream".split()
+
+# Endpoint label -> share of the requests
+WORKLOAD = {
+    "GET /posts/": 40,
+    "GET /posts/?search=": 10,
+    "GET /posts/{id}": 25,
+    "POST /vote/": 20,
+    "POST /login": 5,
+}
+
+
+def seed(engine, users: int, posts: int, votes: int, rng: random.Random):
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    # One bcrypt hash shared by every user, hashing each would dominate the seeding time
+    password = hash(PASSWORD)
+    with engine.begin() as connection:
+        user_ids = connection.scalars(
+            insert(models.User).returning(models.User.id),
+            [{"email": f"user{i}@example.com", "password": password} for i in range(users)],
+        ).all()
+        post_ids = connection.scalars(
+            insert(models.Post).returning(models.Post.id),
+            [
+                {
+                    "title": " ".join(rng.choices(WORDS, k=4)),
+                    "content": " ".join(rng.choices(WORDS, k=40)),
+                    "owner_id": rng.choice(user_ids),
+                }
+                for _ in range(posts)
+            ],
+        ).all()
+        pairs = {(rng.choice(user_ids), rng.choice(post_ids)) for _ in range(votes)}
+        if pairs:
+            connection.execute(insert(models.Vote), [{"user_id": user_id, "post_id": post_id} for user_id, post_id in pairs])
+
+    return user_ids, post_ids
+
+
+def make_request(rng: random.Random, label: str, user_ids, post_ids, tokens):
+    """(method, url, keyword arguments for httpx) for one request of the given kind"""
+    user = rng.randrange(len(user_ids))
+    auth = {"Authorization": f"Bearer {tokens[user]}"}
+    if label == "GET /posts/":
+        return "GET", "/posts/", {"headers": auth}
+    if label == "GET /posts/?search=":
+        return "GET", "/posts/", {"headers": auth, "params": {"search": rng.choice(WORDS)}}
+    if label == "GET /posts/{id}":
+        return "GET", f"/posts/{rng.choice(post_ids)}", {"headers": auth}
+    if label == "POST /vote/":
+        return "POST", "/vote/", {"headers": auth, "json": {"post_id": rng.choice(post_ids), "dir": rng.choice([0, 1])}}
+    if label == "POST /login":
+        return "POST", "/login", {"data": {"username": f"user{user}@example.com", "password": PASSWORD}}
+    raise ValueError(label)
+
+
+async def run(plan, concurrency: int):
+    """Sends the planned requests from `concurrency` clients, returns per label latencies, errors and 503s"""
+    latencies, errors, rejected = defaultdict(list), defaultdict(int), defaultdict(int)
+    queue = iter(plan)
+
+    async def client():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as http:
+            for label, (method, url, kwargs) in queue:
+                start = time.perf_counter()
+                res = await http.request(method, url, **kwargs)
+                # Turned away without doing the work, their latency would flatter the percentiles
+                if res.status_code == 503:
+                    rejected[label] += 1
+                    continue
+                latencies[label].append(time.perf_counter() - start)
+                # 404/409 on votes are part of the workload, only server errors count
+                if res.status_code >= 500:
+                    errors[label] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return latencies, errors, rejected, time.perf_counter() - start
+
+
+async def benchmark(plan, warmup: int, concurrency: int, pool):
+    # One event loop for both rounds, asyncpg connections cannot move between loops
+    await run(plan[:warmup], concurrency)
+    # Pool statistics cover the measured round only
+    pool.stats = metrics.PoolStats()
+    return await run(plan[warmup:], concurrency)
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def summarize(latencies, errors, rejected, elapsed: float):
+    summary = {}
+    for label in WORKLOAD:
+        values = latencies.get(label)
+        if not values:
+            continue
+        summary[label] = {
+            "requests": len(values),
+            "errors": errors.get(label, 0),
+            "rejected": rejected.get(label, 0),
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        }
+    total = sum(len(values) for values in latencies.values())
+    summary["total"] = {"requests": total, "errors": sum(errors.values()), "rejected": sum(rejected.values()), "rps": round(total / elapsed, 1)}
+    return summary
+
+
+def report(summary, baseline=None, tolerance: float = 0.2) -> bool:
+    """Prints the summary, next to the baseline when given, returns False on a p95 regression"""
+    ok = True
+    print(f"{'endpoint':<22}{'requests':>9}{'errors':>7}{'503':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    if baseline and baseline.get("parameters") != summary["parameters"]:
+        print(f"Baseline was recorded with {baseline.get('parameters')}, the comparison is not like for like")
+
+    for label in WORKLOAD:
+        row = summary.get(label)
+        if row is None:
+            continue
+        line = f"{label:<22}{row['requests']:>9}{row['errors']:>7}{row['rejected']:>6}{row['rps']:>9}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}"
+        before = (baseline or {}).get(label)
+        if before:
+            change = row["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0
+            line += f"   p95 {change:+.0%} vs baseline"
+            if change > tolerance:
+                line += "  REGRESSION"
+                ok = False
+        print(line)
+
+    total = summary["total"]
+    print(f"{'total':<22}{total['requests']:>9}{total['errors']:>7}{total['rejected']:>6}{total['rps']:>9}")
+    return ok and not total["errors"]
+
+
+def report_pool(stats, rps: float):
+    """
+    Connections the workload kept busy. By Little's law a worker needs about
+    req/s x mean hold time connections, plus headroom for bursts (the peak)
+    """
+    mean_hold = stats.held_seconds_total / stats.checkouts if stats.checkouts else 0
+    print(
+        f"pool: {stats.checkouts} checkouts, held {mean_hold * 1000:.2f} ms on average "
+        f"(max {stats.held_seconds_max * 1000:.1f} ms), peak {stats.checked_out_max} checked out at once, "
+        f"~{rps * mean_hold:.2f} busy on average"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load")
+    parser.add_argument("--database", default=settings.test_database_name,
+                        help="Scratch database, dropped and reseeded (default: TEST_DATABASE_NAME)")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--votes", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-response-cache", action="store_true", help="Measure GETs against the database every time")
+    parser.add_argument("--baseline", help="Compare with a summary saved by --save-baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 slowdown against the baseline")
+    parser.add_argument("--save-baseline", help="Write this run's summary to the given file")
+    args = parser.parse_args()
+
+    if not args.database or args.database == settings.database_name:
+        sys.exit("Pick a scratch database with --database, its tables are dropped")
+    # One process, so the per-process response cache is safe without Redis
+    settings.response_cache_enabled = not args.no_response_cache
+
+    url = make_url(SQLALCHEMY_DATABASE_URL).set(database=args.database)
+    # Same pool settings as the app, instrumented so the run can report how many connections it needed
+    engine = create_engine(url, **pool_options(metrics.InstrumentedQueuePool))
+    metrics.register_pool("benchmark", engine)
+    rng = random.Random(args.seed)
+    print(f"Seeding {args.users} users, {args.posts} posts, {args.votes} votes into {args.database}")
+    user_ids, post_ids = seed(engine, args.users, args.posts, args.votes, rng)
+    tokens = [create_access_token({"user_id": user_id}) for user_id in user_ids]
+
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        with Session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+
+    if settings.database_async:
+        AsyncSession = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=create_async_engine(url.set(drivername="postgresql+asyncpg")))
+
+        async def override_get_async_db():
+            async with AsyncSession() as db:
+                yield db
+
+        app.dependency_overrides[get_async_db] = override_get_async_db
+        app.dependency_overrides[get_async_read_db] = override_get_async_db
+
+    labels = rng.choices(list(WORKLOAD), weights=list(WORKLOAD.values()), k=args.warmup + args.requests)
+    plan = [(label, make_request(rng, label, user_ids, post_ids, tokens)) for label in labels]
+
+    print(f"{args.requests} requests from {args.concurrency} concurrent clients")
+    summary = summarize(*asyncio.run(benchmark(plan, args.warmup, args.concurrency, engine.pool)))
+    summary["parameters"] = {
+        name: getattr(args, name)
+        for name in ("users", "posts", "votes", "requests", "concurrency", "seed", "no_response_cache")
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    ok = report(summary, baseline, args.tolerance)
+    report_pool(engine.pool.stats, summary["total"]["rps"])
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(summary, f, indent=2)
+            f.write("\n")
+
+    engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
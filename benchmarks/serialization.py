@@ -0,0 +1,77 @@
+"""
+Per-row cost of serializing a GET /posts page.
+
+Compares the default FastAPI path (validate the ORM rows through PostOut with
+from_attributes, dump to JSON-able data, stdlib json) with the direct path the
+posts router uses (plain dicts off the ORM rows, orjson).
+
+    python -m benchmarks.serialization --rows 100 --repeat 200
+"""
+import argparse
+import datetime
+import json
+import time
+from typing import List
+
+from pydantic import TypeAdapter
+
+from app import models
+from app.routers.post import dump_json, post_row
+from app.schemas import PostOut
+
+
+def make_page(rows: int):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    owners = [models.User(id=i, email=f"user{i}@example.com", created_at=now) for i in range(10)]
+    return [
+        {
+            "Post": models.Post(
+                id=i, title=f"Post {i}", content="lorem ipsum " * 20, published=True,
+                created_at=now, owner_id=owners[i % 10].id, owner=owners[i % 10], vote_count=i,
+            ),
+            "Votes": i,
+        }
+        for i in range(rows)
+    ]
+
+
+def fastapi_path(page, adapter):
+    validated = adapter.validate_python(page, from_attributes=True)
+    content = adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+def direct_path(page):
+    return dump_json([{"Post": post_row(item["Post"]), "Votes": item["Votes"]} for item in page])
+
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.serialization")
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    page = make_page(args.rows)
+    adapter = TypeAdapter(List[PostOut])
+
+    # Both paths must produce the same document
+    assert json.loads(fastapi_path(page, adapter)) == json.loads(direct_path(page))
+
+    per_row = args.rows * args.repeat
+    before = timed(lambda: fastapi_path(page, adapter), args.repeat) / per_row
+    after = timed(lambda: direct_path(page), args.repeat) / per_row
+
+    print(f"{args.rows} rows x {args.repeat} pages")
+    print(f"pydantic + json : {before * 1e6:8.2f} us/row")
+    print(f"direct + orjson : {after * 1e6:8.2f} us/row  ({before / after:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
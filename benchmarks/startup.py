@@ -0,0 +1,63 @@
+"""
+Cold start: how long a fresh interpreter takes to import the app, and where the time goes.
+
+Each import is timed in a new `python` process, repeated and reported as the median,
+then one `python -X importtime` run is broken down by top-level package.
+
+    python -m benchmarks.startup --repeat 5
+    python -m benchmarks.startup --module app.models --top 15
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+TIMER = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+
+def import_seconds(module: str) -> float:
+    output = subprocess.run([sys.executable, "-c", TIMER.format(module=module)], capture_output=True, text=True, check=True).stdout
+    return float(output.split()[-1])
+
+
+def import_times(module: str):
+    """Microseconds of self time per imported module, from `python -X importtime`"""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(self_us)
+    return times
+
+
+def by_package(times):
+    packages = defaultdict(int)
+    for name, self_us in times.items():
+        packages[name.split(".")[0]] += self_us
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.startup")
+    parser.add_argument("--module", action="append", help="Module to import (default: app.main and app.models)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Packages to list in the breakdown")
+    args = parser.parse_args()
+    modules = args.module or ["app.main", "app.models"]
+
+    for module in modules:
+        runs = [import_seconds(module) for _ in range(args.repeat)]
+        print(f"import {module}: {statistics.median(runs) * 1000:.0f} ms median of {args.repeat} (min {min(runs) * 1000:.0f} ms)")
+
+    packages = by_package(import_times(modules[0]))
+    total = sum(packages.values())
+    print(f"\n{modules[0]} by top-level package, {total / 1000:.0f} ms of import time")
+    for name, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"{name:<24}{self_us / 1000:>8.1f} ms{self_us / total:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
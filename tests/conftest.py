@@ -1,18 +1,29 @@
+from contextlib import contextmanager
 from turtle import title
 import pytest
+from sqlalchemy import event
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from app import models
 from app.main import app
 import pytest
-from app.database import get_db, Base 
-from tests.database import TestingSessionLocal, test_engine
-from app.oauth2 import create_access_token
+from app.database import get_async_db, get_async_read_db, get_db, get_read_db, Base 
+from app.routers import auth as auth_router, post as post_router, user as user_router, vote as vote_router
+from tests.database import AsyncTestingSessionLocal, TestingSessionLocal, test_engine
+from app.cache import post_cache
+from app.config import settings
+from app.oauth2 import create_access_token, revoked_users, token_cache, user_cache
 
 
 @pytest.fixture
 def session():
     Base.metadata.drop_all(bind=test_engine)
     Base.metadata.create_all(bind=test_engine)
+    # Ids restart with every test database, so nothing cached may outlive it
+    user_cache.clear()
+    revoked_users.clear()
+    token_cache.clear()
+    post_cache.clear()
     db = TestingSessionLocal()
 
     try:
@@ -21,6 +32,39 @@ def session():
         db.close()
 
 
+@pytest.fixture
+def response_cache(monkeypatch):
+    # Off by default without Redis, the tests run in one process where it is safe
+    monkeypatch.setattr(settings, "response_cache_enabled", True)
+
+
+@pytest.fixture
+def query_budget():
+    """
+    Fails the test when the block sends more SQL statements than allowed:
+
+        with query_budget(2) as statements:
+            client.get("/posts/")
+    """
+    @contextmanager
+    def budget(max_queries: int):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(test_engine, "before_cursor_execute", count)
+        try:
+            yield statements
+        finally:
+            event.remove(test_engine, "before_cursor_execute", count)
+
+        assert len(statements) <= max_queries, \
+            f"{len(statements)} queries, budget is {max_queries}:\n" + "\n".join(statements)
+
+    return budget
+
+
 @pytest.fixture
 def client(session):
     def override_get_db():
@@ -30,6 +74,7 @@ def client(session):
             session.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
     yield TestClient(app)
 
 
@@ -111,4 +156,36 @@ def test_posts(test_user, session, test_user2):
     
     session.commit()
 
-    return posts
\ No newline at end of file
+    return posts
+
+
+@pytest.fixture
+def async_client(session):
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    # Same wiring as app.main with DATABASE_ASYNC enabled, without the sync fallbacks
+    async_app = FastAPI()
+    for module in (post_router, user_router, auth_router, vote_router):
+        async_app.include_router(module.async_router)
+    async_app.dependency_overrides[get_async_db] = override_get_async_db
+    async_app.dependency_overrides[get_async_read_db] = override_get_async_db
+
+    yield TestClient(async_app)
+
+
+@pytest.fixture
+def async_authorized_client(async_client):
+    user_data = {"email": "asyncuser@gmail.com", "password": "testPassword"}
+    res = async_client.post("/users/", json=user_data)
+    assert res.status_code == 201
+
+    res = async_client.post("/login", data={"username": user_data["email"], "password": user_data["password"]})
+    assert res.status_code == 200
+
+    async_client.headers = {
+        **async_client.headers,
+        "Authorization": f"Bearer {res.json()['access_token']}"
+    }
+    return async_client
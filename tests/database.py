@@ -1,5 +1,7 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from app.config import settings
 
 # Database URL format: 'postgresql://<username>:<password>@<host>/<database_name>'
@@ -11,3 +13,9 @@ test_engine = create_engine(SQLALCHEMY_DATABASE_URL)
 # Create a session factory
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
 
+# Async engine on the same test database, NullPool since TestClient may drive each request on a new event loop
+ASYNC_SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.test_database_name}"
+
+async_test_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+
+AsyncTestingSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=async_test_engine)
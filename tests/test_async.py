@@ -0,0 +1,120 @@
+from app import models, schemas
+
+
+def test_async_post_lifecycle(async_authorized_client):
+    res = async_authorized_client.post("/posts/", json={"title": "async title", "content": "async content"})
+    assert res.status_code == 201
+    created_post = schemas.Post(**res.json())
+    assert created_post.owner.email == "asyncuser@gmail.com"
+
+    res = async_authorized_client.post("/vote/", json={"post_id": created_post.id, "dir": 1})
+    assert res.status_code == 201
+
+    res = async_authorized_client.get(f"/posts/{created_post.id}")
+    assert res.status_code == 200
+    assert schemas.PostOut(**res.json()).Votes == 1
+
+    res = async_authorized_client.put(f"/posts/{created_post.id}", json={"title": "updated", "content": "updated content"})
+    assert res.status_code == 200
+    assert res.json()["title"] == "updated"
+
+    res = async_authorized_client.get("/posts/")
+    assert res.status_code == 200
+    assert [item["Post"]["id"] for item in res.json()] == [created_post.id]
+
+    res = async_authorized_client.delete(f"/posts/{created_post.id}")
+    assert res.status_code == 204
+
+    res = async_authorized_client.get(f"/posts/{created_post.id}")
+    assert res.status_code == 404
+
+
+def test_async_vote_batch(async_authorized_client):
+    post_ids = [async_authorized_client.post("/posts/", json={"title": title, "content": "batch"}).json()["id"] for title in ("a", "b")]
+
+    res = async_authorized_client.post("/vote/", json={"post_id": 5867, "dir": 1})
+    assert res.status_code == 404
+
+    res = async_authorized_client.post("/vote/batch", json=[
+        {"post_id": post_ids[0], "dir": 1},
+        {"post_id": post_ids[1], "dir": 0},
+        {"post_id": 5867, "dir": 1},
+    ])
+    assert res.status_code == 200
+    assert [item["status"] for item in res.json()] == [201, 404, 404]
+
+    res = async_authorized_client.post("/vote/", json={"post_id": post_ids[0], "dir": 1})
+    assert res.status_code == 409
+
+
+def test_async_deleted_user_cannot_write(async_authorized_client, session):
+    other_user = models.User(email="other@gmail.com", password="not a hash")
+    post = models.Post(title="title", content="content", owner=other_user)
+    session.add(post)
+    session.commit()
+    post_id = post.id
+    session.query(models.User).filter(models.User.id != other_user.id).delete()
+    session.commit()
+
+    assert async_authorized_client.post("/posts/", json={"title": "title", "content": "content"}).status_code == 401
+    assert async_authorized_client.post("/vote/", json={"post_id": post_id, "dir": 1}).status_code == 401
+    assert async_authorized_client.post("/vote/batch", json=[{"post_id": post_id, "dir": 1}]).status_code == 401
+
+
+def test_async_export_posts(async_authorized_client):
+    for title in ("first export", "second export"):
+        async_authorized_client.post("/posts/", json={"title": title, "content": "export"})
+
+    res = async_authorized_client.get("/posts/export", params={"format": "csv"})
+    assert res.status_code == 200
+    lines = res.text.splitlines()
+    assert lines[0] == "id,title,content,published,created_at,owner_id,votes"
+    assert [line.split(",")[1] for line in lines[1:]] == ["first export", "second export"]
+
+
+def test_async_user_posts(async_authorized_client):
+    post_ids = [async_authorized_client.post("/posts/", json={"title": title, "content": "feed"}).json()["id"] for title in ("a", "b")]
+    async_authorized_client.post("/vote/", json={"post_id": post_ids[0], "dir": 1})
+    user_id = async_authorized_client.get(f"/posts/{post_ids[0]}").json()["Post"]["owner_id"]
+
+    res = async_authorized_client.get(f"/users/{user_id}/posts", params={"order_by": "top"})
+    assert res.status_code == 200
+    assert [post["Post"]["id"] for post in res.json()] == post_ids
+
+    res = async_authorized_client.get("/users/5689/posts")
+    assert res.status_code == 404
+
+
+def test_async_get_posts_limit_zero(async_authorized_client):
+    async_authorized_client.post("/posts/", json={"title": "title", "content": "content"})
+
+    res = async_authorized_client.get("/posts/", params={"limit": 0})
+    assert res.status_code == 200
+    assert res.json() == []
+
+
+def test_async_get_user_not_exists(async_client):
+    res = async_client.get("/users/5689")
+    assert res.status_code == 404
+
+
+def test_async_incorrect_login(async_client):
+    res = async_client.post("/login", data={"username": "wrongemail@gmail.com", "password": "wrongpassword"})
+    assert res.status_code == 403
+
+
+def test_async_search_and_cursor(async_authorized_client):
+    for title in ("first async", "second async", "unrelated"):
+        res = async_authorized_client.post("/posts/", json={"title": title, "content": "body"})
+        assert res.status_code == 201
+
+    params = {"search": "async", "order_by": "relevance", "limit": 1}
+    res = async_authorized_client.get("/posts/", params=params)
+    assert res.status_code == 200
+    first_page = res.json()
+
+    res = async_authorized_client.get("/posts/", params={**params, "cursor": res.headers["X-Next-Cursor"]})
+    assert res.status_code == 200
+    second_page = res.json()
+
+    assert sorted(post["Post"]["title"] for post in first_page + second_page) == ["first async", "second async"]
@@ -0,0 +1,140 @@
+import json
+import time
+import pytest
+from fastapi import HTTPException
+from app import models
+from app.config import settings
+from app.cache import MemoryCache, RedisCache
+from app import oauth2
+from app.oauth2 import token_cache, user_cache
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_memory_cache_expires_entries():
+    cache = MemoryCache(maxsize=10, ttl=60)
+    cache.set("short", 1, ttl=0.01)
+    cache.set("long", 2)
+
+    time.sleep(0.02)
+
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+    assert len(cache) == 1
+
+
+class FakeRedis:
+    """Local stand-in for redis.Redis covering the calls RedisCache makes"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, px=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def scan_iter(self, match):
+        return [key for key in list(self.data) if key.startswith(match.rstrip("*"))]
+
+
+def test_redis_cache_round_trips_json():
+    client = FakeRedis()
+    cache = RedisCache(client, prefix="apidev:test:", ttl=60)
+
+    cache.set(1, {"id": 1})
+    assert json.loads(client.data["apidev:test:1"]) == {"id": 1}
+    assert cache.get(1) == {"id": 1}
+
+    cache.clear()
+    assert cache.get(1) is None
+
+
+def test_current_user_is_cached(session, token, test_user):
+    assert oauth2.get_current_user(token, session).email == test_user['email']
+    hits = user_cache.hits
+
+    assert oauth2.get_current_user(token, session).id == test_user['id']
+    assert user_cache.hits == hits + 1
+    assert user_cache.get(test_user['id'])["email"] == test_user['email']
+
+
+def test_principal_skips_users_lookup(authorized_client, test_user):
+    assert authorized_client.get("/posts/").status_code == 200
+    assert user_cache.get(test_user['id']) is None
+
+
+def test_cached_user_invalidated_on_update(session, token, test_user):
+    oauth2.get_current_user(token, session)
+
+    user = session.query(models.User).filter(models.User.id == test_user['id']).first()
+    user.phone_number = "1234567890"
+    session.commit()
+
+    assert user_cache.get(test_user['id']) is None
+
+
+def test_deleted_user_token_rejected(authorized_client, session, token, test_user, monkeypatch):
+    monkeypatch.setattr(settings, "token_revocation_enabled", True)
+    assert authorized_client.get("/posts/").status_code == 200
+
+    session.delete(session.query(models.User).filter(models.User.id == test_user['id']).first())
+    session.commit()
+
+    assert authorized_client.get("/posts/").status_code == 401
+    with pytest.raises(HTTPException):
+        oauth2.get_current_user(token, session)
+
+
+def test_deleted_user_token_accepted_without_revocation(authorized_client, session, test_user):
+    session.delete(session.query(models.User).filter(models.User.id == test_user['id']).first())
+    session.commit()
+
+    # Only the token is checked, the users row is not looked up
+    assert authorized_client.get("/posts/").status_code == 200
+
+
+def test_deleted_user_token_cannot_write(authorized_client, session, test_user, test_posts):
+    # Owned by test_user2, so it outlives test_user
+    post_id = test_posts[3].id
+    session.delete(session.query(models.User).filter(models.User.id == test_user['id']).first())
+    session.commit()
+
+    # Writes that reference the users row fail its foreign key, reported as bad credentials
+    assert authorized_client.post("/posts/", json={"title": "title", "content": "content"}).status_code == 401
+    assert authorized_client.post("/posts/bulk", json=[{"title": "title", "content": "content"}]).status_code == 401
+    assert authorized_client.post("/vote/", json={"post_id": post_id, "dir": 1}).status_code == 401
+    assert authorized_client.post("/vote/batch", json=[{"post_id": post_id, "dir": 1}]).status_code == 401
+
+
+def test_verified_token_is_cached(authorized_client, token):
+    assert authorized_client.get("/posts/").status_code == 200
+    hits = token_cache.hits
+
+    assert authorized_client.get("/posts/").status_code == 200
+    assert token_cache.hits == hits + 1
+    assert token_cache.get(oauth2.token_cache_key(token))["user_id"] is not None
+
+
+def test_token_cache_scoped_to_secret_key(authorized_client, monkeypatch):
+    assert authorized_client.get("/posts/").status_code == 200
+
+    monkeypatch.setattr(oauth2, "SECRET_KEY", "rotated-secret-key")
+
+    assert authorized_client.get("/posts/").status_code == 401
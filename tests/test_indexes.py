@@ -0,0 +1,109 @@
+import random
+import pytest
+from sqlalchemy import delete, insert, select, text
+from app import models
+from app.routers.post import select_export, select_posts
+from app.routers.vote import remove_votes
+from app.utils import encode_cursor
+
+
+@pytest.fixture
+def seeded(session):
+    """A few thousand posts and votes, analyzed so the planner has real statistics"""
+    rng = random.Random(7)
+    user_ids = session.scalars(
+        insert(models.User).returning(models.User.id),
+        [{"email": f"user{i}@example.com", "password": "not a hash"} for i in range(50)],
+    ).all()
+    post_ids = session.scalars(
+        insert(models.Post).returning(models.Post.id),
+        [{"title": f"Post {i}", "content": rng.choice(["fastapi", "postgres", "python"]) + " content", "owner_id": rng.choice(user_ids)} for i in range(3000)],
+    ).all()
+    pairs = {(rng.choice(user_ids), rng.choice(post_ids)) for _ in range(5000)}
+    session.execute(insert(models.Vote), [{"user_id": user_id, "post_id": post_id} for user_id, post_id in pairs])
+    session.commit()
+    session.execute(text("ANALYZE posts, users, votes"))
+    return user_ids, post_ids
+
+
+def plan_nodes(session, stmt):
+    """Every node of the EXPLAIN ANALYZE plan of a statement, run in a transaction that is rolled back"""
+    compiled = stmt.compile(dialect=session.bind.dialect, compile_kwargs={"render_postcompile": True})
+    # Any table read without an index would show up as a Seq Scan
+    session.execute(text("SET LOCAL enable_seqscan = off"))
+    plan = session.connection().exec_driver_sql("EXPLAIN (ANALYZE, FORMAT JSON) " + str(compiled), compiled.params).scalar()
+    session.rollback()
+
+    nodes, stack = [], [plan[0]["Plan"]]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.get("Plans", []))
+    return nodes
+
+
+def assert_uses_index(session, stmt, index_name):
+    nodes = plan_nodes(session, stmt)
+    assert not [node for node in nodes if node["Node Type"] == "Seq Scan"], nodes
+    assert index_name in {node.get("Index Name") for node in nodes}, nodes
+
+
+def test_get_posts_first_page(session, seeded):
+    assert_uses_index(session, select_posts(10, 0, "", None), "ix_posts_created_at_id")
+
+
+def test_get_posts_next_page(session, seeded):
+    post = session.scalars(select(models.Post).order_by(models.Post.id).limit(1)).one()
+    cursor = encode_cursor("newest", [post.created_at, post.id])
+    assert_uses_index(session, select_posts(10, 0, "", cursor), "ix_posts_created_at_id")
+
+
+def test_search_posts_by_relevance(session, seeded):
+    assert_uses_index(session, select_posts(10, 0, "postgres", None, "relevance"), "ix_posts_search_vector")
+
+
+def test_get_post(session, seeded):
+    _, post_ids = seeded
+    stmt = select(models.Post).filter(models.Post.id == post_ids[0])
+    assert_uses_index(session, stmt, "posts_pkey")
+
+
+def test_export_by_owner(session, seeded):
+    user_ids, _ = seeded
+    stmt = select_export("", user_ids[0], None, None, None)
+    assert_uses_index(session, stmt, "ix_posts_owner_id_created_at_id")
+
+
+def test_top_posts(session, seeded):
+    assert_uses_index(session, select_posts(10, 0, "", None, "top"), "ix_posts_vote_count_id")
+
+
+def test_top_posts_next_page(session, seeded):
+    cursor = encode_cursor("top", [1, 100])
+    assert_uses_index(session, select_posts(10, 0, "", cursor, "top"), "ix_posts_vote_count_id")
+
+
+def test_owner_feed(session, seeded):
+    user_ids, _ = seeded
+    assert_uses_index(session, select_posts(10, 0, "", None, "newest", owner_id=user_ids[0]), "ix_posts_owner_id_created_at_id")
+
+
+def test_remove_vote(session, seeded):
+    user_ids, post_ids = seeded
+    assert_uses_index(session, remove_votes(user_ids[0], [post_ids[0]]), "votes_pkey")
+
+
+def test_delete_post_cascades_through_votes_post_id(session, seeded):
+    # What ON DELETE CASCADE runs against votes when a post is deleted
+    _, post_ids = seeded
+    assert_uses_index(session, delete(models.Vote).filter(models.Vote.post_id == post_ids[0]), "ix_votes_post_id")
+
+
+def test_delete_user_cascades_through_posts_owner_id(session, seeded):
+    user_ids, _ = seeded
+    assert_uses_index(session, delete(models.Post).filter(models.Post.owner_id == user_ids[0]), "ix_posts_owner_id_created_at_id")
+
+
+def test_login_user_lookup(session, seeded):
+    stmt = select(models.User).filter(models.User.email == "user1@example.com")
+    assert_uses_index(session, stmt, "users_email_key")
@@ -0,0 +1,138 @@
+import logging
+import re
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, exc, text
+from app import instrumentation, metrics
+from app.config import settings
+from app.instrumentation import TimingMiddleware
+from app.main import app
+from app.metrics import InstrumentedQueuePool
+from tests.database import SQLALCHEMY_DATABASE_URL
+
+
+def test_metrics_endpoint(client):
+    res = client.get("/metrics")
+
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    assert "# TYPE db_pool_checkouts_total counter" in res.text
+    assert 'db_pool_size{pool="primary",' in res.text
+
+
+def test_pool_checkout_timeout_is_counted():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.1)
+    metrics.register_pool("tiny", engine)
+
+    try:
+        with engine.connect():
+            with pytest.raises(exc.TimeoutError):
+                engine.connect()
+
+        stats = engine.pool.stats
+        assert stats.checkouts == 1
+        assert stats.timeouts == 1
+        assert stats.wait_seconds_max >= 0.1
+        assert 'db_pool_checkout_timeouts_total{pool="tiny",' in metrics.render()
+    finally:
+        del metrics.pools["tiny"]
+        engine.dispose()
+
+
+def test_histogram_buckets():
+    histogram = metrics.Histogram("test_seconds", "Test histogram", [0.1, 1])
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, route="/posts/")
+
+    lines = histogram.collect()
+    assert "# TYPE test_seconds histogram" in lines
+    buckets = [line.rsplit(" ", 1)[1] for line in lines if line.startswith("test_seconds_bucket")]
+    assert buckets == ["1", "2", "3"]
+    assert any(line.startswith('test_seconds_count{route="/posts/",') and line.endswith(" 3") for line in lines)
+
+
+def test_request_timing(session, authorized_client, test_posts):
+    instrumentation.instrument_engines()
+    client = TestClient(TimingMiddleware(app), headers=authorized_client.headers)
+
+    res = client.get(f"/posts/{test_posts[0].id}")
+
+    assert res.status_code == 200
+    timing = res.headers["server-timing"]
+    assert timing.startswith("app;dur=")
+    # Cold response cache: just the post, the principal comes from the token alone
+    assert 'desc="1 queries"' in timing
+    assert "auth;dur=" in timing
+
+    lines = instrumentation.REQUEST_SECONDS.collect() + instrumentation.DB_QUERIES.collect()
+    assert any('route="/posts/{id}"' in line and 'status="200"' in line for line in lines)
+    assert any(line.startswith('http_request_db_queries_sum{method="GET",route="/posts/{id}",status="200",') and line.endswith(" 1") for line in lines)
+
+
+def test_request_timing_async(async_authorized_client):
+    instrumentation.instrument_engines()
+    client = TestClient(TimingMiddleware(async_authorized_client.app), headers=async_authorized_client.headers)
+
+    res = client.get("/posts/")
+
+    assert res.status_code == 200
+    # Statements run on asyncpg through greenlets are counted too
+    assert int(re.search(r'desc="(\d+) queries"', res.headers["server-timing"]).group(1)) >= 1
+
+
+def test_slow_query_log(session, monkeypatch, caplog):
+    instrumentation.instrument_engines()
+    monkeypatch.setattr(settings, "slow_query_ms", 0.0001)
+
+    with caplog.at_level(logging.WARNING, logger="app.instrumentation"):
+        session.execute(text("SELECT pg_sleep(0.01)"))
+
+    assert any("Slow query" in record.getMessage() and "pg_sleep" in record.getMessage() for record in caplog.records)
+
+
+def test_pool_hold_time_is_measured():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool, pool_size=2, max_overflow=0)
+    metrics.register_pool("held", engine)
+
+    try:
+        with engine.connect(), engine.connect():
+            assert engine.pool.stats.checked_out == 2
+
+        stats = engine.pool.stats
+        assert stats.checked_out == 0
+        assert stats.checked_out_max == 2
+        assert stats.held_seconds_total >= stats.held_seconds_max > 0
+        assert 'db_pool_held_seconds_max{pool="held",' in metrics.render()
+    finally:
+        del metrics.pools["held"]
+        engine.dispose()
+
+
+def test_process_metrics(client):
+    before = metrics.RequestCounter.requests
+    client.get("/")
+    res = client.get("/metrics")
+
+    assert metrics.RequestCounter.requests == before + 2
+    assert re.search(r'^http_requests_total\{pid="\d+"\} \d+$', res.text, re.MULTILINE)
+    assert re.search(r'^process_resident_memory_bytes\{pid="\d+"\} [1-9]\d*$', res.text, re.MULTILINE)
+
+
+def test_reset_pools_after_fork():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool)
+    metrics.register_pool("forked", engine)
+
+    try:
+        with engine.connect():
+            pass
+        metrics.reset_pools()
+
+        # A fresh instrumented pool, still timed by the listeners on the engine
+        assert isinstance(engine.pool, InstrumentedQueuePool)
+        assert engine.pool.stats.checkouts == 0
+        with engine.connect():
+            assert engine.pool.stats.checked_out == 1
+        assert engine.pool.stats.checkouts == 1
+    finally:
+        del metrics.pools["forked"]
+        engine.dispose()
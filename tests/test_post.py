@@ -1,5 +1,13 @@
-from app import schemas
+import csv
+import io
+import json
+from app import models, schemas
+from app.routers import post as post_router
+from app.config import settings
+from pydantic import TypeAdapter
+from typing import List
 import pytest
+from tests.database import test_engine
 
 
 def test_get_all_posts(authorized_client, test_posts):
@@ -27,6 +35,143 @@ def test_get_all_posts(authorized_client, test_posts):
         assert isinstance(post.Votes, int)  # Verify votes count is present
 
 
+def test_get_posts_matches_schema_serialization(authorized_client, test_posts):
+    res = authorized_client.get("/posts/")
+
+    # The direct serialization path must be byte-for-byte what the response model would produce
+    adapter = TypeAdapter(List[schemas.PostOut])
+    assert res.content == adapter.dump_json(adapter.validate_json(res.content))
+
+
+def test_get_posts_cursor_pagination(authorized_client, test_posts):
+    res = authorized_client.get("/posts/?limit=3")
+    assert res.status_code == 200
+    first_page = res.json()
+    assert len(first_page) == 3
+
+    cursor = res.headers["X-Next-Cursor"]
+    res = authorized_client.get("/posts/", params={"limit": 3, "cursor": cursor})
+    assert res.status_code == 200
+    second_page = res.json()
+    assert "X-Next-Cursor" not in res.headers
+
+    ids = [post["Post"]["id"] for post in first_page + second_page]
+    assert sorted(ids, reverse=True) == ids
+    assert set(ids) == {post.id for post in test_posts}
+
+
+def test_get_posts_limit_zero(authorized_client, test_user, test_posts):
+    for url in ("/posts/", f"/users/{test_user['id']}/posts"):
+        res = authorized_client.get(url, params={"limit": 0})
+        assert res.status_code == 200
+        assert res.json() == []
+        assert "X-Next-Cursor" not in res.headers
+
+
+def test_get_posts_invalid_cursor(authorized_client, test_posts):
+    res = authorized_client.get("/posts/", params={"cursor": "not-a-cursor"})
+    assert res.status_code == 400
+
+
+def test_search_posts(authorized_client, test_posts):
+    res = authorized_client.get("/posts/", params={"search": "second"})
+    assert res.status_code == 200
+    assert [post["Post"]["title"] for post in res.json()] == ["Second Post"]
+
+    # Matches words in the content too
+    res = authorized_client.get("/posts/", params={"search": "content"})
+    assert len(res.json()) == len(test_posts)
+
+
+def test_search_posts_by_relevance(authorized_client, test_posts):
+    res = authorized_client.get("/posts/", params={"search": "third or first", "order_by": "relevance", "limit": 2})
+    assert res.status_code == 200
+    first_page = res.json()
+
+    # Keyset paging follows the ranked order
+    res = authorized_client.get("/posts/", params={
+        "search": "third or first", "order_by": "relevance", "limit": 2, "cursor": res.headers["X-Next-Cursor"]
+    })
+    second_page = res.json()
+
+    titles = [post["Post"]["title"] for post in first_page + second_page]
+    assert sorted(titles) == ["First Post", "Third Post", "Third Post"]
+
+
+def test_cursor_from_other_ordering_rejected(authorized_client, test_posts):
+    res = authorized_client.get("/posts/", params={"limit": 1})
+
+    res = authorized_client.get("/posts/", params={
+        "search": "post", "order_by": "relevance", "cursor": res.headers["X-Next-Cursor"]
+    })
+    assert res.status_code == 400
+
+
+def test_get_top_posts(authorized_client, test_posts, session):
+    post_ids = [post.id for post in test_posts]
+    session.query(models.Post).filter(models.Post.id == post_ids[2]).update({models.Post.vote_count: 5})
+    session.query(models.Post).filter(models.Post.id == post_ids[0]).update({models.Post.vote_count: 2})
+    session.commit()
+
+    res = authorized_client.get("/posts/", params={"order_by": "top", "limit": 2})
+    assert [post["Post"]["id"] for post in res.json()] == [post_ids[2], post_ids[0]]
+
+    # Ties on the vote count page by id
+    res = authorized_client.get("/posts/", params={"order_by": "top", "limit": 2, "cursor": res.headers["X-Next-Cursor"]})
+    assert [post["Post"]["id"] for post in res.json()] == [post_ids[3], post_ids[1]]
+
+
+def test_get_posts_by_owner(authorized_client, test_user2, test_posts):
+    res = authorized_client.get("/posts/", params={"owner_id": test_user2["id"]})
+
+    assert res.status_code == 200
+    assert [post["Post"]["owner_id"] for post in res.json()] == [test_user2["id"]]
+
+
+def test_get_posts_not_modified(authorized_client, test_posts, response_cache):
+    res = authorized_client.get("/posts/")
+    etag = res.headers["ETag"]
+
+    res = authorized_client.get("/posts/", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.content == b""
+
+    # A write changes the page, so the old ETag no longer matches
+    authorized_client.post("/posts/", json={"title": "fresh title", "content": "fresh content"})
+    res = authorized_client.get("/posts/", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert len(res.json()) == len(test_posts) + 1
+
+
+def test_get_one_post_served_from_cache(authorized_client, test_posts, response_cache, query_budget):
+    post_id = test_posts[0].id
+    assert authorized_client.get(f"/posts/{post_id}").status_code == 200
+
+    with query_budget(0):
+        assert authorized_client.get(f"/posts/{post_id}").json()["Post"]["title"] == "First Post"
+
+
+def test_response_cache_off_without_redis(authorized_client, test_posts, query_budget):
+    post_id = test_posts[0].id
+    assert authorized_client.get(f"/posts/{post_id}").status_code == 200
+
+    # Each worker would have its own copy, which a write in another worker cannot drop
+    with query_budget(1) as statements:
+        assert authorized_client.get(f"/posts/{post_id}").status_code == 200
+    assert len(statements) == 1
+
+
+def test_get_one_post_cache_invalidated_by_update(authorized_client, test_posts, response_cache):
+    post_id = test_posts[0].id
+    res = authorized_client.get(f"/posts/{post_id}")
+    assert res.json()["Post"]["title"] == "First Post"
+
+    authorized_client.put(f"/posts/{post_id}", json={"title": "Renamed", "content": "First post content"})
+
+    res = authorized_client.get(f"/posts/{post_id}")
+    assert res.json()["Post"]["title"] == "Renamed"
+
+
 def test_unauthorized_user_get_all_posts(client, test_posts):
     res = client.get("/posts/")
     assert res.status_code == 401
@@ -146,4 +291,164 @@ def test_update_post_not_exists(authorized_client, test_posts, test_user):
     }
 
     res = authorized_client.put(f"/posts/5689", json=data)
-    assert res.status_code == 404
\ No newline at end of file
+    assert res.status_code == 404
+
+def test_export_posts_ndjson(authorized_client, test_posts):
+    post_ids = [post.id for post in test_posts]
+    res = authorized_client.get("/posts/export")
+
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in res.text.splitlines()]
+    assert [row["id"] for row in rows] == sorted(post_ids)
+    assert set(rows[0]) == {"id", "title", "content", "published", "created_at", "owner_id", "votes"}
+
+
+def test_export_posts_csv_filtered(authorized_client, test_user, test_posts):
+    post_ids = [post.id for post in test_posts]
+    res = authorized_client.get("/posts/export", params={"format": "csv", "owner_id": test_user["id"], "search": "second"})
+
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(res.text)))
+    assert [int(row["id"]) for row in rows] == [post_ids[1]]
+    assert rows[0]["title"] == "Second Post"
+
+
+def test_export_posts_created_range(authorized_client, test_posts):
+    res = authorized_client.get("/posts/export", params={"created_after": "2999-01-01T00:00:00", "published": True})
+    assert res.status_code == 200
+    assert res.text == ""
+
+
+def test_unauthorized_user_export_posts(client, test_posts):
+    res = client.get("/posts/export")
+    assert res.status_code == 401
+
+
+def test_bulk_create_posts(authorized_client, test_user):
+    res = authorized_client.post("/posts/bulk", json=[
+        {"title": "first", "content": "first content"},
+        {"title": "no content"},
+        {"title": "third", "content": "third content", "published": False},
+    ])
+
+    assert res.status_code == 200
+    result = schemas.BulkPostResult(**res.json())
+    assert result.created == 2
+    assert [error.index for error in result.errors] == [1]
+    assert result.errors[0].detail[0]["loc"] == ["content"]
+
+    posts = [authorized_client.get(f"/posts/{id}").json()["Post"] for id in result.ids]
+    assert [post["title"] for post in posts] == ["first", "third"]
+    assert posts[1]["published"] == False
+    assert {post["owner_id"] for post in posts} == {test_user['id']}
+
+
+def test_bulk_create_posts_ndjson(authorized_client, test_posts, monkeypatch):
+    monkeypatch.setattr(settings, "bulk_insert_batch_size", 2)
+    lines = [
+        '{"title": "one", "content": "1"}',
+        '{"title": "two", "content": "2"',
+        '',
+        '{"title": "three", "content": "3"}',
+        '{"title": "nul \\u0000", "content": "rejected by the database"}',
+        '{"title": "five", "content": "5"}',
+    ]
+
+    def body():
+        # Split across chunks in the middle of a line
+        data = "\n".join(lines).encode()
+        yield data[:20]
+        yield data[20:]
+
+    res = authorized_client.post("/posts/bulk", content=body(), headers={"Content-Type": "application/x-ndjson"})
+
+    assert res.status_code == 200
+    result = res.json()
+    assert result["created"] == 3
+    assert [error["index"] for error in result["errors"]] == [1, 3]
+    assert result["errors"][0]["detail"][0]["type"] == "json_invalid"
+
+    titles = [post["Post"]["title"] for post in authorized_client.get("/posts/?limit=20").json()]
+    assert {"one", "three", "five"} <= set(titles)
+
+
+def test_bulk_create_posts_not_an_array(authorized_client):
+    res = authorized_client.post("/posts/bulk", json={"title": "one", "content": "1"})
+    assert res.status_code == 400
+
+
+def test_unauthorized_user_bulk_create_posts(client):
+    res = client.post("/posts/bulk", json=[{"title": "one", "content": "1"}])
+    assert res.status_code == 401
+
+
+# Query budgets, with cold caches. get_current_principal authenticates from the token alone, without SQL
+
+def test_get_posts_query_budget(authorized_client, test_posts, query_budget):
+    with query_budget(1):
+        res = authorized_client.get("/posts/")
+    assert res.status_code == 200
+    assert {post["Post"]["owner"]["id"] for post in res.json()} == {post.owner_id for post in test_posts}
+
+
+def test_get_one_post_query_budget(authorized_client, test_posts, query_budget):
+    post_id = test_posts[0].id
+    with query_budget(1):
+        res = authorized_client.get(f"/posts/{post_id}")
+    assert res.status_code == 200
+
+
+def test_create_post_query_budget(authorized_client, test_user, query_budget):
+    with query_budget(2):
+        res = authorized_client.post("/posts/", json={"title": "budget", "content": "budget content"})
+    assert res.status_code == 201
+    assert res.json()["owner"]["email"] == test_user["email"]
+
+
+def test_update_post_query_budget(authorized_client, test_posts, query_budget):
+    post_id, owner_id = test_posts[0].id, test_posts[0].owner_id
+    with query_budget(1):
+        res = authorized_client.put(f"/posts/{post_id}", json={"title": "budget", "content": "budget content"})
+    assert res.status_code == 200
+    assert res.json()["owner"]["id"] == owner_id
+
+
+def test_delete_post_query_budget(authorized_client, test_posts, query_budget):
+    post_id = test_posts[0].id
+    with query_budget(1):
+        res = authorized_client.delete(f"/posts/{post_id}")
+    assert res.status_code == 204
+
+
+def test_update_other_user_post_is_unchanged(authorized_client, test_posts, session, query_budget):
+    post_id, title = test_posts[3].id, test_posts[3].title
+    # The refused UPDATE, then the lookup that tells 403 from 404
+    with query_budget(2):
+        res = authorized_client.put(f"/posts/{post_id}", json={"title": "hijacked", "content": "hijacked"})
+    assert res.status_code == 403
+    assert session.get(models.Post, post_id).title == title
+
+
+def test_bulk_create_posts_query_budget(authorized_client, query_budget):
+    posts = [{"title": f"bulk {i}", "content": "bulk content"} for i in range(50)]
+    with query_budget(1):
+        res = authorized_client.post("/posts/bulk", json=posts)
+    assert res.json()["created"] == 50
+
+
+def test_get_post_releases_connection_before_response(authorized_client, test_posts, monkeypatch):
+    post_id = test_posts[0].id
+    checked_out = []
+    send_cached = post_router.send_cached
+
+    def record(request, entry):
+        checked_out.append(test_engine.pool.checkedout())
+        return send_cached(request, entry)
+
+    monkeypatch.setattr(post_router, "send_cached", record)
+    res = authorized_client.get(f"/posts/{post_id}")
+
+    assert res.status_code == 200
+    assert checked_out == [0]
@@ -0,0 +1,157 @@
+import asyncio
+import pytest
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from starlette.requests import Request
+from app import database
+from app.cache import invalidate_posts, post_cache
+from app.config import settings
+from app.database import ReplicaSet, get_read_db
+from app.routers.post import cache_response
+from tests.database import ASYNC_SQLALCHEMY_DATABASE_URL, SQLALCHEMY_DATABASE_URL, AsyncTestingSessionLocal, TestingSessionLocal, test_engine
+
+
+def make_request(token=None):
+    headers = [(b"authorization", f"Bearer {token}".encode())] if token else []
+    return Request({"type": "http", "headers": headers})
+
+
+@pytest.fixture
+def replica_engines(session, monkeypatch):
+    # A replica that refuses connections and a working one, on the test database
+    down = create_engine(make_url(SQLALCHEMY_DATABASE_URL).set(host="127.0.0.1", port=1))
+    up = create_engine(SQLALCHEMY_DATABASE_URL)
+    monkeypatch.setattr(database, "SessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(database, "replicas", ReplicaSet([down, up], retry_after=60))
+    yield down, up
+    down.dispose()
+    up.dispose()
+
+
+def test_replica_set_round_robin():
+    replicas = ReplicaSet(["a", "b", "c"], retry_after=60)
+    assert [replicas.candidates()[0] for _ in range(4)] == ["a", "b", "c", "a"]
+
+
+def test_replica_set_skips_failed_replica():
+    a, b = create_engine("postgresql://replica-a/apidev"), create_engine("postgresql://replica-b/apidev")
+    replicas = ReplicaSet([a, b], retry_after=60)
+    replicas.mark_down(a)
+    assert [replicas.candidates() for _ in range(2)] == [[b], [b]]
+
+    replicas.retry_after = 0
+    replicas.mark_down(a)
+    assert replicas.candidates() == [a, b]
+
+
+def test_read_db_falls_over_to_healthy_replica(replica_engines):
+    down, up = replica_engines
+
+    for _ in range(2):
+        dependency = get_read_db(make_request())
+        db = next(dependency)
+        assert db.get_bind() is up
+        dependency.close()
+
+    assert database.replicas.candidates() == [up]
+
+
+def test_read_db_falls_back_to_primary(replica_engines, monkeypatch):
+    monkeypatch.setattr(database, "replicas", ReplicaSet([replica_engines[0]], retry_after=60))
+
+    dependency = get_read_db(make_request())
+    assert next(dependency).get_bind() is test_engine
+    dependency.close()
+
+
+def test_read_your_writes(replica_engines, monkeypatch):
+    monkeypatch.setattr(settings, "read_your_writes_seconds", 5)
+    monkeypatch.setattr(database.recent_writers, "ttl", 5)
+    database.recent_writers.clear()
+
+    # A commit through get_db keeps that client's reads on the primary
+    dependency = database.get_db(make_request("writer"))
+    db = next(dependency)
+    db.commit()
+    dependency.close()
+
+    reader = get_read_db(make_request("reader"))
+    assert next(reader).get_bind() is replica_engines[1]
+    reader.close()
+
+    writer = get_read_db(make_request("writer"))
+    assert next(writer).get_bind() is test_engine
+    writer.close()
+
+
+def test_read_db_connects_on_first_statement(replica_engines):
+    down, up = replica_engines
+
+    dependency = get_read_db(make_request())
+    db = next(dependency)
+    # A response served from the cache would never touch the pool
+    assert up.pool.checkedout() == 0
+    assert len(database.replicas.candidates()) == 2
+
+    assert db.execute(text("SELECT 1")).scalar() == 1
+    assert db.get_bind() is up
+    assert up.pool.checkedout() == 1
+    assert database.read_from_replica(db)
+    dependency.close()
+    assert up.pool.checkedout() == 0
+
+
+@pytest.fixture
+def async_replica_engines(session, monkeypatch):
+    down = create_async_engine(make_url(ASYNC_SQLALCHEMY_DATABASE_URL).set(host="127.0.0.1", port=1), poolclass=NullPool)
+    up = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+    monkeypatch.setattr(database, "AsyncSessionLocal", AsyncTestingSessionLocal)
+    monkeypatch.setattr(database, "async_replicas", ReplicaSet([down, up], retry_after=60))
+    return down, up
+
+
+def test_async_read_db_falls_over_to_healthy_replica(async_replica_engines):
+    down, up = async_replica_engines
+
+    async def read():
+        dependency = database.get_async_read_db(make_request())
+        db = await anext(dependency)
+        assert (await db.execute(text("SELECT 1"))).scalar() == 1
+        assert db.sync_session.get_bind() is up.sync_engine
+        await dependency.aclose()
+
+    asyncio.run(read())
+    assert database.async_replicas.candidates() == [up]
+
+
+def test_replica_reads_not_cached_after_write(replica_engines, monkeypatch):
+    monkeypatch.setattr(settings, "response_cache_enabled", True)
+    monkeypatch.setattr(settings, "read_your_writes_seconds", 5)
+    dependency = get_read_db(make_request())
+    db = next(dependency)
+    db.execute(text("SELECT 1"))
+
+    cache_response("before write", [], db=db)
+    assert post_cache.get("before write") is not None
+
+    # The replica may not have the write yet, the writer kept on the primary would be served its old page
+    invalidate_posts()
+    cache_response("after write", [], db=db)
+    assert post_cache.get("after write") is None
+
+    # Reads from the primary are cached as usual
+    cache_response("from primary", [])
+    assert post_cache.get("from primary") is not None
+    dependency.close()
+
+
+def test_async_export_from_replica(async_authorized_client, async_replica_engines):
+    for title in ("first export", "second export"):
+        async_authorized_client.post("/posts/", json={"title": title, "content": "export"})
+    # Reads go through the real dependency, onto the replicas
+    del async_authorized_client.app.dependency_overrides[database.get_async_read_db]
+
+    res = async_authorized_client.get("/posts/export", params={"format": "csv"})
+    assert res.status_code == 200
+    assert [line.split(",")[1] for line in res.text.splitlines()[1:]] == ["first export", "second export"]
@@ -0,0 +1,68 @@
+import pytest
+from app import serve
+from app.config import settings
+
+
+@pytest.fixture
+def cgroup(tmp_path):
+    def write(path, content):
+        file = tmp_path / path
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(content)
+        return tmp_path
+    return write
+
+
+def test_cgroup_v2_quota(cgroup):
+    assert serve.cgroup_cpu_limit(cgroup("cpu.max", "150000 100000\n")) == 1.5
+
+
+def test_cgroup_v2_unlimited(cgroup):
+    assert serve.cgroup_cpu_limit(cgroup("cpu.max", "max 100000\n")) is None
+
+
+def test_cgroup_v1_quota(cgroup):
+    cgroup("cpu/cpu.cfs_period_us", "100000\n")
+    assert serve.cgroup_cpu_limit(cgroup("cpu/cpu.cfs_quota_us", "50000\n")) == 0.5
+
+
+def test_cgroup_v1_unlimited(cgroup):
+    cgroup("cpu/cpu.cfs_period_us", "100000\n")
+    assert serve.cgroup_cpu_limit(cgroup("cpu/cpu.cfs_quota_us", "-1\n")) is None
+
+
+def test_available_cpus_capped_by_quota(cgroup, monkeypatch):
+    monkeypatch.setattr(serve.os, "sched_getaffinity", lambda pid: {0, 1, 2, 3, 4, 5, 6, 7})
+    # A fractional quota still gets a whole worker
+    assert serve.available_cpus(cgroup("cpu.max", "250000 100000\n")) == 3
+    assert serve.available_cpus(cgroup("cpu.max", "10000 100000\n")) == 1
+
+
+def test_available_cpus_without_cgroup(tmp_path, monkeypatch):
+    monkeypatch.setattr(serve.os, "sched_getaffinity", lambda pid: {0, 1})
+    assert serve.available_cpus(tmp_path) == 2
+
+
+def test_options(monkeypatch):
+    monkeypatch.setattr(settings, "web_concurrency", 3)
+    monkeypatch.setattr(settings, "max_requests", 1000)
+
+    options = serve.options()
+
+    assert options["workers"] == 3
+    assert options["preload_app"] is True
+    assert options["worker_class"] is serve.Worker
+    assert options["max_requests_jitter"] == 100
+    assert serve.Worker.CONFIG_KWARGS == {"loop": "uvloop", "http": "httptools"}
+
+
+def test_options_refuse_per_process_response_cache(monkeypatch):
+    monkeypatch.setattr(settings, "web_concurrency", 2)
+    monkeypatch.setattr(settings, "response_cache_enabled", True)
+    monkeypatch.setattr(settings, "cache_redis_url", None)
+
+    with pytest.raises(SystemExit):
+        serve.options()
+
+    monkeypatch.setattr(settings, "web_concurrency", 1)
+    assert serve.options()["workers"] == 1
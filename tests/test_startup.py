@@ -0,0 +1,27 @@
+import subprocess
+import sys
+from benchmarks.startup import import_times
+
+# Generous for slow CI machines, the app's own modules take under 100 ms on a development machine
+APP_IMPORT_BUDGET_US = 400_000
+
+
+def loaded_after(module: str, *names):
+    """Which of `names` a fresh interpreter has loaded after importing `module`"""
+    code = f"import sys, {module}; print(' '.join(name for name in {names!r} if name in sys.modules))"
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.split()
+
+
+def test_app_does_not_import_passlib():
+    assert loaded_after("app.main", "passlib", "bcrypt") == []
+
+
+def test_models_do_not_import_fastapi():
+    # Alembic and the maintenance commands only need the models
+    assert loaded_after("app.models", "fastapi") == []
+
+
+def test_app_import_time_budget():
+    times = import_times("app.main")
+    spent = sum(self_us for name, self_us in times.items() if name == "app" or name.startswith("app."))
+    assert spent < APP_IMPORT_BUDGET_US, sorted(times.items(), key=lambda item: item[1], reverse=True)[:10]
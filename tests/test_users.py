@@ -1,7 +1,11 @@
-from app import schemas
+from app import models, schemas, utils
 import jwt
+import threading
+from passlib.context import CryptContext
 from app.config import settings
 import pytest
+from app.routers import auth
+from tests.database import test_engine
 
 
 def test_create_user(client):
@@ -47,3 +51,69 @@ def test_incorrect_login(test_user, client, email, password, expected_status):
 
     assert res.status_code == expected_status
 
+
+def test_login_rehashes_outdated_work_factor(client, session):
+    weak_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("password123")
+    session.add(models.User(email="legacy@gmail.com", password=weak_hash))
+    session.commit()
+
+    res = client.post("/login", data={"username": "legacy@gmail.com", "password": "password123"})
+    assert res.status_code == 200
+
+    user = session.query(models.User).filter(models.User.email == "legacy@gmail.com").first()
+    assert user.password != weak_hash
+    assert user.password.startswith(f"$2b${settings.bcrypt_rounds:02d}$")
+
+
+
+def test_login_verifies_password_without_a_connection(test_user, client, monkeypatch):
+    checked_out = []
+    verify_and_update = auth.verify_and_update
+
+    def record(password, stored_hash):
+        checked_out.append(test_engine.pool.checkedout())
+        return verify_and_update(password, stored_hash)
+
+    monkeypatch.setattr(auth, "verify_and_update", record)
+    res = client.post("/login", data={"username": test_user["email"], "password": test_user["password"]})
+
+    assert res.status_code == 200
+    assert checked_out == [0]
+
+def test_password_hasher_saturated(client, monkeypatch):
+    monkeypatch.setattr(utils, "_hasher_slots", threading.BoundedSemaphore(1))
+    utils._hasher_slots.acquire()
+
+    res = client.post("/users/", json={"email": "busy@gmail.com", "password": "password123"})
+
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == "1"
+
+
+def test_get_user_posts(authorized_client, test_user, test_posts):
+    res = authorized_client.get(f"/users/{test_user['id']}/posts", params={"limit": 2})
+
+    assert res.status_code == 200
+    posts = res.json()
+    assert [post["Post"]["title"] for post in posts] == ["Third Post", "Second Post"]
+    assert {post["Post"]["owner_id"] for post in posts} == {test_user['id']}
+
+    res = authorized_client.get(f"/users/{test_user['id']}/posts", params={"limit": 2, "cursor": res.headers["X-Next-Cursor"]})
+    assert [post["Post"]["title"] for post in res.json()] == ["First Post"]
+    assert "X-Next-Cursor" not in res.headers
+
+
+def test_get_user_posts_none(authorized_client, test_user):
+    res = authorized_client.get(f"/users/{test_user['id']}/posts")
+    assert res.status_code == 200
+    assert res.json() == []
+
+
+def test_get_user_posts_user_not_exists(authorized_client):
+    res = authorized_client.get("/users/5689/posts")
+    assert res.status_code == 404
+
+
+def test_get_user_posts_unauthorized(client, test_user):
+    res = client.get(f"/users/{test_user['id']}/posts")
+    assert res.status_code == 401
@@ -1,5 +1,13 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
 import pytest
-from app import models
+from app import models, schemas
+from app.config import settings
+from app.maintenance import reconcile_vote_counts
+from app.oauth2 import Principal
+from app.routers.vote import vote_batch
+from app.vote_buffer import VoteBuffer, vote_buffer
+from tests.database import TestingSessionLocal
 
 
 @pytest.fixture
@@ -9,6 +17,16 @@ def test_vote(test_posts, session, test_user):
     session.commit()
 
 
+@pytest.fixture
+def buffered_votes(session, monkeypatch):
+    monkeypatch.setattr(settings, "vote_buffer_enabled", True)
+    monkeypatch.setattr(vote_buffer, "session_factory", TestingSessionLocal)
+    # Only flushed when the test asks
+    monkeypatch.setattr(vote_buffer, "interval", 3600)
+    yield vote_buffer
+    vote_buffer.stop()
+
+
 def test_vote_on_post(authorized_client, test_posts):
     res = authorized_client.post("/vote/", json = {
         "post_id": test_posts[3].id, "dir": 1
@@ -54,4 +72,207 @@ def test_vote_unauthorized_user(client, test_posts):
         "post_id": test_posts[3].id, "dir": 1
     })
 
-    assert res.status_code == 401
\ No newline at end of file
+    assert res.status_code == 401
+
+def test_vote_updates_post_votes(authorized_client, test_posts):
+    post_id = test_posts[3].id
+
+    res = authorized_client.post("/vote/", json = {"post_id": post_id, "dir": 1})
+    assert res.status_code == 201
+
+    res = authorized_client.get(f"/posts/{post_id}")
+    assert res.json()["Votes"] == 1
+
+    res = authorized_client.post("/vote/", json = {"post_id": post_id, "dir": 0})
+    assert res.status_code == 201
+
+    res = authorized_client.get(f"/posts/{post_id}")
+    assert res.json()["Votes"] == 0
+
+
+def test_vote_query_budget(authorized_client, test_posts, query_budget):
+    post_id = test_posts[3].id
+    # Just the INSERT ... ON CONFLICT or the DELETE
+    with query_budget(1):
+        res = authorized_client.post("/vote/", json = {"post_id": post_id, "dir": 1})
+    assert res.status_code == 201
+
+    with query_budget(1):
+        res = authorized_client.post("/vote/", json = {"post_id": post_id, "dir": 0})
+    assert res.status_code == 201
+
+
+def test_vote_batch(authorized_client, test_posts, test_vote):
+    post_ids = [post.id for post in test_posts]
+    res = authorized_client.post("/vote/batch", json = [
+        {"post_id": post_ids[0], "dir": 1},
+        {"post_id": post_ids[3], "dir": 1},
+        {"post_id": 5867, "dir": 1},
+        {"post_id": post_ids[1], "dir": 0},
+        {"post_id": post_ids[3], "dir": 0},
+        {"post_id": post_ids[0], "dir": 0},
+    ])
+
+    assert res.status_code == 200
+    assert [(item["post_id"], item["status"]) for item in res.json()] == [
+        (post_ids[0], 201),
+        (post_ids[3], 409),
+        (5867, 404),
+        (post_ids[1], 404),
+        (post_ids[3], 400),
+        (post_ids[0], 400),
+    ]
+
+    res = authorized_client.get(f"/posts/{post_ids[0]}")
+    assert res.json()["Votes"] == 1
+
+
+def test_vote_batch_delete(authorized_client, test_posts, test_vote):
+    post_ids = [post.id for post in test_posts]
+    res = authorized_client.post("/vote/batch", json = [{"post_id": post_ids[3], "dir": 0}])
+
+    assert res.json() == [{"post_id": post_ids[3], "dir": 0, "status": 201, "detail": "Vote Deleted Successfully"}]
+    assert authorized_client.get(f"/posts/{post_ids[3]}").json()["Votes"] == 0
+
+
+def test_vote_batch_empty(authorized_client):
+    res = authorized_client.post("/vote/batch", json = [])
+    assert res.status_code == 200
+    assert res.json() == []
+
+
+def test_vote_batch_unauthorized_user(client, test_posts):
+    res = client.post("/vote/batch", json = [{"post_id": test_posts[3].id, "dir": 1}])
+    assert res.status_code == 401
+
+
+def test_concurrent_vote_batches_do_not_deadlock(session):
+    users = [models.User(email=f"voter{i}@gmail.com", password="not a hash") for i in range(8)]
+    posts = [models.Post(title=f"Post {i}", content="content", owner=users[0]) for i in range(20)]
+    session.add_all(users + posts)
+    session.commit()
+    user_ids, post_ids = [user.id for user in users], [post.id for post in posts]
+
+    def voter(user_id):
+        rng, order = random.Random(user_id), list(post_ids)
+        for turn in range(10):
+            # The same posts in a different order each time, voted up then taken back
+            rng.shuffle(order)
+            votes = [schemas.Vote(post_id=post_id, dir=1 - turn % 2) for post_id in order]
+            with TestingSessionLocal() as db:
+                vote_batch(votes, db, Principal(user_id, {}))
+
+    with ThreadPoolExecutor(len(user_ids)) as pool:
+        for result in [pool.submit(voter, user_id) for user_id in user_ids]:
+            result.result()
+
+    assert session.query(models.Vote).count() == 0
+    assert {count for count, in session.query(models.Post.vote_count)} == {0}
+
+
+def test_concurrent_vote_buffer_flushes_do_not_deadlock(session):
+    users = [models.User(email=f"voter{i}@gmail.com", password="not a hash") for i in range(8)]
+    posts = [models.Post(title=f"Post {i}", content="content", owner=users[0]) for i in range(20)]
+    session.add_all(users + posts)
+    session.commit()
+    user_ids, post_ids = [user.id for user in users], [post.id for post in posts]
+
+    def worker(user_id):
+        # One buffer per worker process, flushing the same hot posts
+        buffer = VoteBuffer(size=1000, interval=3600, session_factory=TestingSessionLocal)
+        rng, order = random.Random(user_id), list(post_ids)
+        for turn in range(10):
+            rng.shuffle(order)
+            for post_id in order:
+                buffer.add(user_id, post_id, turn % 2 == 0)
+            buffer.flush()
+        return buffer.failed_flushes
+
+    with ThreadPoolExecutor(len(user_ids)) as pool:
+        assert list(pool.map(worker, user_ids)) == [0] * len(user_ids)
+
+    assert session.query(models.Vote).count() == 0
+    assert {count for count, in session.query(models.Post.vote_count)} == {0}
+
+
+def test_buffered_votes(authorized_client, test_posts, session, buffered_votes):
+    post_id = test_posts[0].id
+
+    for dir in (1, 0, 1):
+        res = authorized_client.post("/vote/", json = {"post_id": post_id, "dir": dir})
+        assert res.status_code == 202
+
+    # Coalesced into one pending vote, already counted on the read side
+    assert len(buffered_votes) == 1
+    assert authorized_client.get(f"/posts/{post_id}").json()["Votes"] == 1
+    assert session.query(models.Vote).count() == 0
+
+    assert buffered_votes.flush() == 1
+    assert session.query(models.Vote).filter(models.Vote.post_id == post_id).count() == 1
+    assert buffered_votes.delta(post_id) == 0
+    assert authorized_client.get(f"/posts/{post_id}").json()["Votes"] == 1
+
+
+def test_buffered_votes_dropped_on_flush(authorized_client, test_posts, test_vote, session, buffered_votes):
+    post_id, other_post_id = test_posts[3].id, test_posts[1].id
+
+    assert authorized_client.post("/vote/", json = {"post_id": post_id, "dir": 1}).status_code == 202
+    assert authorized_client.post("/vote/", json = {"post_id": 5867, "dir": 1}).status_code == 202
+    assert authorized_client.post("/vote/", json = {"post_id": other_post_id, "dir": 0}).status_code == 202
+
+    # Repeated vote, vote on a missing post and removal of a missing vote are no-ops
+    assert buffered_votes.flush() == 3
+    assert buffered_votes.delta(post_id) == 0
+    assert authorized_client.get(f"/posts/{post_id}").json()["Votes"] == 1
+    assert session.query(models.Vote).count() == 1
+
+
+def test_buffered_votes_of_deleted_user_dropped_on_flush(authorized_client, test_posts, test_user, session, buffered_votes):
+    assert authorized_client.post("/vote/", json = {"post_id": test_posts[3].id, "dir": 1}).status_code == 202
+    session.delete(session.query(models.User).filter(models.User.id == test_user['id']).first())
+    session.commit()
+
+    assert buffered_votes.flush() == 1
+    assert buffered_votes.failed_flushes == 0
+    assert session.query(models.Vote).count() == 0
+
+
+def test_buffered_vote_replaced_during_failed_flush(test_posts, test_user, session, buffered_votes, monkeypatch):
+    post_id = test_posts[0].id
+    buffered_votes.add(test_user['id'], post_id, True)
+
+    def failing_session():
+        # The same user takes the vote back while the flush is writing it
+        buffered_votes.add(test_user['id'], post_id, False)
+        raise ConnectionError("database unavailable")
+
+    monkeypatch.setattr(buffered_votes, "session_factory", failing_session)
+    assert buffered_votes.flush() == 0
+    assert buffered_votes.failed_flushes == 1
+    assert buffered_votes.delta(post_id) == -1
+
+    monkeypatch.setattr(buffered_votes, "session_factory", TestingSessionLocal)
+    assert buffered_votes.flush() == 1
+    assert buffered_votes.delta(post_id) == 0
+    assert session.query(models.Vote).count() == 0
+
+
+def test_buffered_votes_drained_on_shutdown(client, token, test_posts, session, buffered_votes):
+    post_id = test_posts[0].id
+
+    with client:
+        res = client.post("/vote/", json = {"post_id": post_id, "dir": 1}, headers = {"Authorization": f"Bearer {token}"})
+        assert res.status_code == 202
+
+    assert len(buffered_votes) == 0
+    assert session.query(models.Post.vote_count).filter(models.Post.id == post_id).scalar() == 1
+
+
+def test_reconcile_vote_counts(session, test_posts, test_vote):
+    session.query(models.Post).update({models.Post.vote_count: 7}, synchronize_session=False)
+    session.commit()
+
+    assert reconcile_vote_counts(session) == len(test_posts)
+
+    counts = {post.id: post.vote_count for post in session.query(models.Post)}
+    assert counts == {post.id: 1 if post.id == test_posts[3].id else 0 for post in test_posts}